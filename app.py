@@ -6,7 +6,28 @@ import dash_core_components as dcc
 import dash_html_components as html
 import plotly.graph_objs as go
 import pandas
-from dash.dependencies import Input, Output
+import numpy
+import pyarrow.feather as feather
+import os
+import json
+import shutil
+import hashlib
+import io
+import threading
+import time
+import functools
+import logging
+import urllib.request
+import flask
+import gzip
+import brotli
+import mimetypes
+import plotly
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pandas.api.types import union_categoricals
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 # data URL
 consegne = 'https://raw.githubusercontent.com/italia/covid19-opendata-vaccini/master/dati/consegne-vaccini-latest.csv'
 fascia_anagrafica = 'https://raw.githubusercontent.com/italia/covid19-opendata-vaccini/master/dati/platea.csv'
@@ -14,39 +35,157 @@ somministrazioni = 'https://raw.githubusercontent.com/italia/covid19-opendata-va
 decessi_contagi = 'https://raw.githubusercontent.com/pcm-dpc/COVID-19/master/dati-andamento-nazionale/dpc-covid19-ita-andamento-nazionale.csv'
 decessi_contagi_regioni = 'https://raw.githubusercontent.com/pcm-dpc/COVID-19/master/dati-regioni/dpc-covid19-ita-regioni.csv'
 guariti = 'https://raw.githubusercontent.com/italia/covid19-opendata-vaccini/master/dati/soggetti-guariti.csv'
+sources = (consegne, somministrazioni, decessi_contagi, decessi_contagi_regioni, fascia_anagrafica, guariti)
 population = 0
+# region dimension: name in the vaccine data, code in the vaccine and platea data, code and name in the DPC data, population
+regioni = pandas.DataFrame([
+    ('Abruzzo', 'ABR', 13, 'Abruzzo', 1312000),
+    ('Basilicata', 'BAS', 17, 'Basilicata', 562869),
+    ('Calabria', 'CAL', 18, 'Calabria', 1947000),
+    ('Campania', 'CAM', 15, 'Campania', 5802000),
+    ('Emilia-Romagna', 'EMR', 8, 'Emilia-Romagna', 4459000),
+    ('Friuli-Venezia Giulia', 'FVG', 6, 'Friuli Venezia Giulia', 1215000),
+    ('Lazio', 'LAZ', 12, 'Lazio', 5879000),
+    ('Liguria', 'LIG', 7, 'Liguria', 1551000),
+    ('Lombardia', 'LOM', 3, 'Lombardia', 10060000),
+    ('Marche', 'MAR', 11, 'Marche', 1525000),
+    ('Molise', 'MOL', 14, 'Molise', 305617),
+    ('Provincia Autonoma Bolzano / Bozen', 'PAB', 21, 'P.A. Bolzano', 520891),
+    ('Provincia Autonoma Trento', 'PAT', 22, 'P.A. Trento', 538223),
+    ('Piemonte', 'PIE', 1, 'Piemonte', 4356000),
+    ('Puglia', 'PUG', 16, 'Puglia', 4029000),
+    ('Sardegna', 'SAR', 20, 'Sardegna', 1640000),
+    ('Sicilia', 'SIC', 19, 'Sicilia', 5000000),
+    ('Toscana', 'TOS', 9, 'Toscana', 3730000),
+    ('Umbria', 'UMB', 10, 'Umbria', 882015),
+    ("Valle d'Aosta / Vallée d'Aoste", 'VDA', 2, "Valle d'Aosta", 125666),
+    ('Veneto', 'VEN', 5, 'Veneto', 4906000),
+], columns=['reg', 'area', 'codice_regione', 'denominazione_regione', 'popolazione']).set_index('reg')
 
-last_update = ''  # last update
-max_prima_f = ''  # max first dose in 1day
-tot_janssenf = ''  # tot only 1 dose format
-tot_janssen = ''  # tot only 1 dose
-month_last_day_vaccine = ''  # 90% population vaccine date
-percent_mese = ''  # percentage
-percent_mese_vaccine = ''
-percent_mese_death = ''  # percentage death
-percent_mese_vaccine_death = ''
-primadose = 0
-secondadose = 0
-terzadose = 0  #dose_addizionale_booster
-quartadose = 0
 pandas.options.mode.chained_assignment = None  # default='warn'
+dosi = ['d1', 'd2', 'dpi', 'db1', 'db2']  # dose columns
+# load schema of the administrations: repeated labels as categoricals, counts as narrow unsigned ints, data is parsed as datetime64
+schema_somministrazioni = {'data': 'object', 'forn': 'category', 'eta': 'category', 'reg': 'category', **{dose: 'uint32' for dose in dosi}}
+day_ms = 86400000  # one day on a plotly date axis
+risoluzioni = [(183, 'D'), (1100, 'W'), (None, 'M')]  # days visible up to, period of the time series points
+correzioni_dpc = {('Dato Nazionale', '2020-06-24', 'nuovi_decessi'): 31}  # known errors of the DPC data: (area, day, column) -> value
+# headline KPIs: dose totals with the day their campaign started, then the shares of population and platea
+kpi_dosi = [('prima', 'd1', '2020-12-27'), ('seconda', 'd2', '2020-12-27'), ('terza', 'db1', '2021-09-15'), ('quarta', 'db2', '2022-02-01'), ('covid', 'dpi', '2020-12-27')]
+kpi_percentuali = ['prima_bidose', 'vaccinati', 'terza', 'quarta', 'janssen', 'covid', 'guariti_senza', 'guariti_con']
+kpi_colonne = ([nome for nome, col, inizio in kpi_dosi] + ['janssen', 'consegne', 'vaccinati', 'prima_bidose', 'guariti_senza', 'guariti_con', 'popolazione', 'platea']
+               + [nome + '_pop' for nome in kpi_percentuali] + [nome + '_platea' for nome in kpi_percentuali] + ['positivi_mese', 'decessi_mese'])
+Kpi = namedtuple('Kpi', kpi_colonne)  # one row of the KPI array, a tuple with no per instance dict
+# forecast: projected doses with their KPI, chart label and color, and their targets as shares of the population, the last one is everybody;
+# a projection runs at the pace of a trailing window, one for each window
+previsione_dosi = [('prima', 'd1', '1ª', '#F5C05F', [0.85, 1]), ('seconda', 'd2', '2ª', '#78F5B3', [0.8, 1]),
+                   ('terza', 'db1', '3ª', '#B768FE', [0.7, 1]), ('quarta', 'db2', '4ª', '#5B3EAB', [0.7, 1])]
+previsione_finestre = [('Mensile', relativedelta(months=1))]  # label and length of the trailing windows
+Previsioni = namedtuple('Previsioni', ['giorni', 'cumulate', 'date'])  # forecast arrays of a snapshot, areas as in aree
+dpc_incidenze = {'nuovi_positivi': 'Nuovi Positivi', 'nuovi_ospedalizzati': 'Ospedalizzati',
+                 'ingressi_terapia_intensiva': 'Terapia Intensiva', 'nuovi_decessi': 'Decessi'}  # daily columns with a rate per 100.000
+# age chart: bands with the age groups of the data they merge, series as coefficients of the doses and the platea
+fasce_eta = [('12-19', ['12-19']), ('20-29', ['20-29']), ('30-39', ['30-39']), ('40-49', ['40-49']),
+             ('50-59', ['50-59']), ('60-69', ['60-69']), ('70-79', ['70-79']), ('80+', ['80-89', '90+'])]
+serie_eta = [
+    ('Prima Dose', '#F5C05F', {'d1': 1, 'd2': -1, 'db1': 1, 'db2': 1}),
+    ('Seconda Dose', '#E83A8E', {'d2': 1, 'db1': -1, 'db2': -1}),
+    ('Terza Dose', '#B768FE', {'db1': 1, 'db2': -1}),
+    ('Quarta Dose', '#5B3EAB', {'db2': 1}),
+    ('Non vaccinati', '#6181E8', {'platea': 1, 'd2': -1}),
+]
+eta_gruppi = [gruppo for label, gruppi in fasce_eta for gruppo in gruppi]
+eta_colonne = dosi + ['platea']
+eta_bande = numpy.array([[gruppo in gruppi for gruppo in eta_gruppi] for label, gruppi in fasce_eta], dtype='int64')  # band x age group
+eta_coeff = numpy.array([[coeff.get(col, 0) for col in eta_colonne] for name, color, coeff in serie_eta], dtype='int64')  # series x column
+refresh_interval = int(os.environ.get('REFRESH_INTERVAL', 3600))  # seconds between background refreshes
+refresh_lock = threading.Lock()
+cache_dir = os.environ.get('CACHE_DIR', 'cache')  # local copy of the upstream csv
+fetch_timeout = int(os.environ.get('FETCH_TIMEOUT', 60))  # seconds
+fetch_retries = int(os.environ.get('FETCH_RETRIES', 2))  # extra attempts per source, with backoff
+snapshot_dir = os.environ.get('SNAPSHOT_DIR', os.path.join(cache_dir, 'snapshot'))  # parsed frames and derived tables as feather files
+refresh_mode = os.environ.get('REFRESH_MODE', 'standalone')  # standalone, publisher (refresh and derive the snapshot) or reader (only map its tables)
+snapshot_poll = int(os.environ.get('SNAPSHOT_POLL', 60))  # seconds between snapshot checks in reader mode
+snapshot_wait = int(os.environ.get('SNAPSHOT_WAIT', 20))  # seconds a reader waits for the first snapshot, below the gunicorn boot timeout
+data_version = None  # source digests and date of the last refresh, kept by the refresh thread
+frames = {}  # parsed frames of the last refresh, the next delta applies to them
+snapshot_names = ('dc', 'cube', 'reg_forn_dosi', 'reg_eta', 'righe', 'ddc', 'ddcr', 'dfe', 'dg')  # frames of a snapshot
+derived_names = ('dc', 'dc_reg', 'dpc', 'ds_dosi', 'forn_dosi', 'reg_dosi', 'reg_forn_dosi', 'riduzione', 'dim_regioni', 'eta',
+                 'dosi_regioni', 'kpi', 'cumulate', 'arrivi')  # derived tables of a snapshot, the only ones a reader maps
+# derived data of a snapshot, assembled by snapshot_from_tables and published with one reference swap;
+# a request takes the reference once and only reads it, so threaded workers never see a half refreshed dataset
+Snapshot = namedtuple('Snapshot', [
+    'version', 'today', 'last_update', 'max_prima_f', 'regions', 'aree', 'dc', 'dc_reg', 'ddc', 'dpc', 'ds_dosi', 'ds_reg',
+    'forn_dosi', 'reg_dosi', 'reg_forn_dosi', 'riduzione', 'dim_regioni', 'eta_valori', 'dosi_regioni', 'kpi', 'previsioni'])
+snapshot = None  # derived data in memory
+figure_cache = OrderedDict()  # (callback, input, data version) -> (time, output), least recently used first
+figure_cache_size = int(os.environ.get('FIGURE_CACHE_SIZE', 256))
+figure_cache_ttl = int(os.environ.get('FIGURE_CACHE_TTL', 86400))  # seconds
+response_cache = OrderedDict()  # digest of the data version and request body -> body of a callback response, least recently used first
+response_cache_size = int(os.environ.get('RESPONSE_CACHE_SIZE', 512))
+layout_cache = None  # (data version, etag, encoded json) of the layout served to every visitor
+asset_cache = {}  # asset name -> (mtime, etag, encoded body)
+asset_max_age = int(os.environ.get('ASSET_MAX_AGE', 86400))  # seconds, dash adds the mtime to asset urls
+brotli_quality = int(os.environ.get('BROTLI_QUALITY', 9))
+compressed_mimetypes = {'text/css', 'application/javascript', 'text/javascript', 'application/json', 'image/svg+xml'}
+
+
+# download a csv into the local cache, revalidating with ETag / Last-Modified
+# returns the local path and the sha1 of its content
+def fetch_csv(url):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, url.rsplit('/', 1)[1])
+    meta = {}
+    if os.path.exists(path) and os.path.exists(path + '.json'):
+        with open(path + '.json') as f:
+            meta = json.load(f)
+    request = urllib.request.Request(url)
+    if meta.get('etag'):
+        request.add_header('If-None-Match', meta['etag'])
+    if meta.get('last_modified'):
+        request.add_header('If-Modified-Since', meta['last_modified'])
+    for attempt in range(fetch_retries + 1):
+        try:
+            with urllib.request.urlopen(request, timeout=fetch_timeout) as response:
+                body = response.read()
+                headers = response.headers
+            break
+        except OSError as e:
+            if meta and getattr(e, 'code', None) == 304:  # not modified
+                return path, meta['sha1']
+            if attempt < fetch_retries and getattr(e, 'code', 500) >= 500:  # timeouts, resets and server errors
+                time.sleep(2 ** attempt)
+                continue
+            if not meta:
+                raise
+            logger.warning('fetch of %s failed, using the cached copy: %s', url, e)  # upstream down, keep the last good copy
+            return path, meta['sha1']
+    meta = {'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified'), 'sha1': hashlib.sha1(body).hexdigest()}
+    with open(path + '.tmp', 'wb') as f:
+        f.write(body)
+    os.replace(path + '.tmp', path)
+    with open(path + '.json', 'w') as f:
+        json.dump(meta, f)
+    return path, meta['sha1']
 
-# read csv for url and get date
-dc = pandas.read_csv(consegne)
-ds = pandas.read_csv(somministrazioni)
-ddc = pandas.read_csv(decessi_contagi)
-ddcr = pandas.read_csv(decessi_contagi_regioni)
-dfe = pandas.read_csv(fascia_anagrafica)
-dg = pandas.read_csv(guariti)
-regions = ds['reg'].drop_duplicates().tolist()  # all regions
 
 plotly_js_minified = ['https://cdn.plot.ly/plotly-basic-latest.min.js']
 app = dash.Dash(__name__, external_scripts=plotly_js_minified,
                 meta_tags=[{'name': 'viewport', 'content': 'width=device-width, initial-scale=0.8, maximum-scale=1.2, minimum-scale=0.5'}],
                 requests_pathname_prefix='/vaccine/',
-                routes_pathname_prefix='/vaccine/')
+                routes_pathname_prefix='/vaccine/',
+                suppress_callback_exceptions=True)  # the charts are created by callbacks
 app.title = 'Dashboard Vaccini'
 server = app.server
+# the logger dash made for this module, it prints to stdout: under gunicorn send it to the error log,
+# run directly to stderr in the same format
+logger = logging.getLogger(__name__)
+logger.propagate = False
+if logging.getLogger('gunicorn.error').handlers:
+    logger.handlers = logging.getLogger('gunicorn.error').handlers
+    logger.setLevel(logging.getLogger('gunicorn.error').level)
+else:
+    logger.handlers = [logging.StreamHandler()]
+    logger.handlers[0].setFormatter(logging.Formatter('[%(asctime)s] [%(process)d] [%(levelname)s] %(message)s', '%Y-%m-%d %H:%M:%S %z'))
 # chart config
 chart_config = {'displaylogo': False, 'displayModeBar': False, 'responsive': True}
 # slider buttons (1m, 3m, 6m, all)
@@ -57,100 +196,730 @@ slider_button = list([
     dict(step="all")
 ])
 
+# parse administrations with the declared schema, only the columns the cube needs
+def read_somministrazioni(source):
+    return pandas.read_csv(source, usecols=list(schema_somministrazioni), dtype=schema_somministrazioni, parse_dates=['data'])
+
+
+# reduce administrations to the region x date x supplier x age cube
+def aggregate_somministrazioni(ds):
+    cube = ds.groupby(['reg', 'data', 'forn', 'eta'], sort=False, observed=True)[dosi].sum().astype('int32').reset_index()
+    for col in ('reg', 'forn', 'eta'):  # categories in sorted order whatever the file order, like the merged ones
+        cube[col] = cube[col].cat.set_categories(sorted(cube[col].cat.remove_unused_categories().cat.categories))
+    return cube
+
+
+# rollups of the cube kept with the snapshot, flat with categorical keys
+def cube_rollups(cube):
+    reg_forn = cube.groupby(['reg', 'forn', 'data'], observed=True)[dosi].sum().reset_index()
+    reg_eta = cube.groupby(['reg', 'eta'], observed=True)[dosi].sum().reset_index()
+    return reg_forn.astype({'reg': 'category', 'forn': 'category'}), reg_eta.astype({'reg': 'category', 'eta': 'category'})
+
+
+# concatenate frames keeping categorical columns categorical
+def concat_frames(parts):
+    return pandas.DataFrame({
+        col: union_categoricals([part[col] for part in parts], sort_categories=True)
+        if isinstance(parts[0][col].dtype, pandas.CategoricalDtype) else numpy.concatenate([part[col].to_numpy() for part in parts])
+        for col in parts[0].columns})
+
+
+# byte range and digest of every date of the administrations csv, the header is the '' row;
+# None when the file does not start with a date column sorted ascending
+def date_ranges(body):
+    header_end = body.index(b'\n') + 1
+    if not body.startswith(b'data,'):
+        return None
+    raw = numpy.frombuffer(body, dtype=numpy.uint8)
+    starts = numpy.concatenate([[header_end], numpy.flatnonzero(raw[header_end:] == 10) + header_end + 1])
+    starts = starts[starts + 10 <= len(body)]
+    giorni = raw[starts[:, None] + numpy.arange(10)].copy().view('S10').ravel()
+    if (giorni[1:] < giorni[:-1]).any():
+        return None
+    primo = numpy.flatnonzero(numpy.r_[True, giorni[1:] != giorni[:-1]])
+    inizio = numpy.r_[0, starts[primo]]
+    fine = numpy.r_[inizio[1:], len(body)]
+    view = memoryview(body)
+    return pandas.DataFrame({
+        'data': [''] + giorni[primo].astype(str).tolist(),
+        'inizio': inizio,
+        'fine': fine,
+        'sha1': [hashlib.sha1(view[a:b]).hexdigest() for a, b in zip(inizio, fine)],
+    })
+
+
+# administrations, incremental: only the dates new or revised since the frames in memory are parsed
+# and applied to the cube and its rollups, a changed header or an unsorted file reloads everything
+def ingest_somministrazioni(path):
+    with open(path, 'rb') as f:
+        body = f.read()
+    righe = date_ranges(body)
+    old_righe = frames.get('righe')
+    old_sha1 = dict(zip(old_righe['data'], old_righe['sha1'])) if old_righe is not None else {}
+    if righe is None or old_sha1.get('') != righe['sha1'][0] or 'reg_eta' not in frames or frames['cube']['data'].dtype.kind != 'M':
+        cube = aggregate_somministrazioni(read_somministrazioni(io.BytesIO(body)))
+        reg_forn, reg_eta = cube_rollups(cube)
+        if righe is None:
+            righe = pandas.DataFrame({'data': [], 'inizio': [], 'fine': [], 'sha1': []})
+        logger.info('administrations: full load of %d rows', len(cube))
+        return {'cube': cube, 'reg_forn_dosi': reg_forn, 'reg_eta': reg_eta, 'righe': righe}
+    nuove = righe[[old_sha1.get(d) != h for d, h in zip(righe['data'], righe['sha1'])]]
+    cambiate = pandas.to_datetime(list(set(nuove['data']) | (set(old_sha1) - set(righe['data']))))  # new, revised or dropped upstream
+    view = memoryview(body)
+    delta = aggregate_somministrazioni(read_somministrazioni(io.BytesIO(
+        b''.join([view[:righe['fine'][0]]] + [view[a:b] for a, b in zip(nuove['inizio'], nuove['fine'])]))))
+    old_cube = frames['cube']
+    tolte = old_cube['data'].isin(cambiate).to_numpy()
+    delta_forn, delta_eta = cube_rollups(delta)
+    old_forn, old_eta = cube_rollups(old_cube[tolte])
+    reg_forn = frames['reg_forn_dosi']
+    reg_eta = (frames['reg_eta'].set_index(['reg', 'eta'])
+               .sub(old_eta.set_index(['reg', 'eta']), fill_value=0)
+               .add(delta_eta.set_index(['reg', 'eta']), fill_value=0)
+               .astype('int32').reset_index())
+    logger.info('administrations: %d dates changed, %d rows parsed', len(cambiate), len(delta))
+    return {
+        'cube': concat_frames([old_cube[~tolte], delta]),
+        'reg_forn_dosi': concat_frames([reg_forn[~reg_forn['data'].isin(cambiate)], delta_forn]),
+        'reg_eta': reg_eta.astype({'reg': 'category', 'eta': 'category'}),
+        'righe': righe,
+    }
+
+
+# parse the changed sources into typed frames in parallel, the unchanged ones are reused from memory
+def parse_sources(files, changed):
+    new_frames = dict(frames)
+    with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+        letti = {name: pool.submit(pandas.read_csv, files[url][0])
+                 for url, name in ((consegne, 'dc'), (decessi_contagi, 'ddc'), (decessi_contagi_regioni, 'ddcr'), (fascia_anagrafica, 'dfe'), (guariti, 'dg'))
+                 if url in changed or name not in new_frames}
+        if somministrazioni in changed or 'cube' not in new_frames:
+            letti['somministrazioni'] = pool.submit(ingest_somministrazioni, files[somministrazioni][0])
+        for name, letto in letti.items():
+            if name == 'somministrazioni':
+                new_frames.update(letto.result())
+            else:
+                new_frames[name] = letto.result()
+    return new_frames
+
+
+# write frames as uncompressed feather files in a directory, each one replaced atomically
+def write_frames(path, new_frames):
+    os.makedirs(path, exist_ok=True)
+    tmp = '.tmp%d' % os.getpid()
+    for name, frame in new_frames.items():
+        feather.write_feather(frame, os.path.join(path, name + '.feather' + tmp), compression='uncompressed')
+        os.replace(os.path.join(path, name + '.feather' + tmp), os.path.join(path, name + '.feather'))
+
+
+# memory map frames written by write_frames, numeric, datetime and categorical columns are not copied
+def read_frames(path, names):
+    return {name: feather.read_table(os.path.join(path, name + '.feather'), memory_map=True).to_pandas(split_blocks=True) for name in names}
+
+
+# write the frames under a new version and the derived tables of a day under it, then point current.json at them;
+# the derived tables and their metadata are only there when the publisher computed them
+def save_snapshot(new_frames, digests, derived=None):
+    version = hashlib.sha1(''.join(digests).encode()).hexdigest()[:12]
+    path = os.path.join(snapshot_dir, version)
+    write_frames(path, new_frames)
+    current = {'version': version, 'digests': digests}
+    if derived is not None:
+        tables, meta = derived
+        write_frames(os.path.join(path, meta['today']), tables)
+        current.update(meta)
+    tmp = '.tmp%d' % os.getpid()
+    with open(os.path.join(snapshot_dir, 'current.json' + tmp), 'w') as f:
+        json.dump(current, f)
+    os.replace(os.path.join(snapshot_dir, 'current.json' + tmp), os.path.join(snapshot_dir, 'current.json'))
+    # old versions and days stay readable by whoever still has them mapped
+    for old in os.listdir(snapshot_dir):
+        if old != version and os.path.isdir(os.path.join(snapshot_dir, old)):
+            shutil.rmtree(os.path.join(snapshot_dir, old), ignore_errors=True)
+    for old in os.listdir(path) if derived is not None else []:
+        if old != current['today'] and os.path.isdir(os.path.join(path, old)):
+            shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+
+
+# version, digests and derived metadata of the published snapshot, None when there is none yet
+def current_snapshot():
+    try:
+        with open(os.path.join(snapshot_dir, 'current.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# memory map the frames of the current snapshot, the next delta applies to them
+def load_snapshot():
+    current = current_snapshot()
+    if current is None:  # nothing published yet
+        return None, None
+    try:
+        return read_frames(os.path.join(snapshot_dir, current['version']), snapshot_names), tuple(current['digests'])
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning('no usable snapshot in %s: %r', snapshot_dir, e)
+        return None, None
+
+
+# memory map the derived tables of the current snapshot, None until the publisher wrote them
+def load_derived():
+    current = current_snapshot()
+    if current is None or 'today' not in current:
+        return None, None
+    try:
+        return read_frames(os.path.join(snapshot_dir, current['version'], current['today']), derived_names), current
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning('no usable derived tables in %s: %r', snapshot_dir, e)
+        return None, None
+
+
 # refresh data
 def refresh_data():
-    global today, last_update, max_prima_f
-    global dc, ds, dfa, ddc, dfe, tot_dfe, ds_dosi
-    global tot_prima_dose, tot_seconda_dose, tot_terza_dose, tot_prima, tot_seconda, tot_terza, tot_covid, tot_with_covid, tot_quarta, tot_quarta_dose
-    global percent_mese_death, percent_mese, healed_no, healed_with
-    # read csv for url and get date
-    dc = pandas.read_csv(consegne)
-    ds = pandas.read_csv(somministrazioni)
-    ddc = pandas.read_csv(decessi_contagi)
-    dfe = pandas.read_csv(fascia_anagrafica)
+    global data_version, frames
+    # revalidate the sources in parallel, nothing to rebuild if neither the data nor the date changed;
+    # a source that cannot be fetched falls back to its cached copy
+    with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+        files = dict(zip(sources, pool.map(fetch_csv, sources)))
+    digests = tuple(sha1 for path, sha1 in files.values())
     today = date.today()
+    if (digests, today) == data_version:
+        return
+    # parse only the sources whose content changed, a new day only rebuilds the derived data
+    old_digests = dict(zip(sources, data_version[0])) if data_version is not None else {}
+    changed = [url for url, digest in zip(sources, digests) if old_digests.get(url) != digest]
+    new_frames = parse_sources(files, changed) if changed else frames
+    if refresh_mode == 'publisher':
+        # derive once for all the workers, they only map the tables
+        save_snapshot(new_frames if changed else {}, digests, derive_tables(new_frames, today))
+        data_version, frames = (digests, today), new_frames
+    else:
+        if changed:
+            save_snapshot(new_frames, digests)
+        build_data(new_frames, (digests, today))
+
+
+# version of the derived tables described by current.json
+def derived_version(current):
+    return tuple(current['digests']), date.fromisoformat(current['today'])
+
+
+# reader mode: map the derived tables published by the refresher process when they change
+def reload_snapshot():
+    current = current_snapshot()
+    if current is None or 'today' not in current or derived_version(current) == data_version:
+        return
+    tables, current = load_derived()
+    if tables is not None:
+        publish_snapshot(snapshot_from_tables(tables, current, derived_version(current)), {})
+
 
-    # doses delivered
-    dc = dc.groupby('data_consegna').agg({'numero_dosi': 'sum'}).reset_index()
-    # doses administered
-    ds_dosi = ds.groupby('data').agg({'d1': 'sum', 'd2': 'sum', 'dpi': 'sum', 'db1': 'sum', 'db2': 'sum'}).reset_index()
+# national and regional DPC data in one table by area (vaccine region name or 'Dato Nazionale') and day,
+# derived once per refresh in grouped passes: daily deaths and hospitalisations, 30 day means, rates per 100.000
+def dpc_table(ddc, ddcr):
+    reg_by_codice = regioni.reset_index().set_index('codice_regione')['reg']
+    ddcr = ddcr[ddcr['codice_regione'].isin(reg_by_codice.index)]
+    table = pandas.concat([ddc.assign(reg='Dato Nazionale'), ddcr.assign(reg=ddcr['codice_regione'].map(reg_by_codice).values)], ignore_index=True)
+    table = table.set_index([table['reg'].astype('category'), pandas.DatetimeIndex(table['data'].str[:10], name='giorno')]).sort_index(kind='stable')
+    table = table[['data', 'nuovi_positivi', 'deceduti', 'totale_ospedalizzati', 'ingressi_terapia_intensiva']]
+    table['data'] = pandas.to_datetime(table['data'])
+    by_reg = table.groupby(level='reg')
+    table['nuovi_decessi'] = by_reg['deceduti'].diff().fillna(table['deceduti']).astype(int)
+    table['nuovi_ospedalizzati'] = by_reg['totale_ospedalizzati'].diff().fillna(table['totale_ospedalizzati'])
+    for (reg, giorno, col), valore in correzioni_dpc.items():
+        if (reg, pandas.Timestamp(giorno)) not in table.index:  # a truncated feed, do not add an unsorted row
+            logger.warning('DPC correction of %s on %s skipped, the day is missing', reg, giorno)
+            continue
+        table.loc[(reg, pandas.Timestamp(giorno)), col] = valore
+    medie = table.groupby(level='reg')[['nuovi_positivi', 'nuovi_decessi']].rolling(30).mean().round(1).droplevel(0)
+    table['nuovi_positivi_avg'], table['nuovi_decessi_avg'] = medie['nuovi_positivi'], medie['nuovi_decessi']
+    popolazione = regioni['popolazione'].reindex(table.index.get_level_values('reg')).fillna(60360000).to_numpy()
+    for col in dpc_incidenze:
+        table[col + '_100k'] = table[col] * 100000 / popolazione
+    return table
+
+
+# running totals per area and day of the columns of a frame with a region and a day for each row: all rows for the
+# country first, then each region; day 0 is a zero, so the total of a time window is a difference of two binary searched days
+def area_prefix_sums(frame, reg, giorno, regions):
+    giorno = pandas.DatetimeIndex(giorno).normalize()
+    giorni = pandas.date_range(giorno.min(), giorno.max())
+    totali = numpy.zeros((len(regions) + 1, len(giorni) + 1, frame.shape[1]), dtype='int64')
+    righe = pandas.Index(regions).get_indexer(numpy.asarray(reg, dtype=str))
+    colonne = giorni.get_indexer(giorno) + 1
+    valori = frame.to_numpy().astype('int64')
+    numpy.add.at(totali, (0, colonne), valori)
+    noti = righe >= 0
+    numpy.add.at(totali, (righe[noti] + 1, colonne[noti]), valori[noti])
+    return giorni, totali.cumsum(axis=1)
+
+
+# total per area of each column from the first to the last day included, area x column
+def area_window_sum(prefix, first, last):
+    giorni, somme = prefix
+    i = giorni.searchsorted(pandas.Timestamp(str(first)[:10]), 'left')
+    j = giorni.searchsorted(pandas.Timestamp(str(last)[:10]), 'right')
+    return somme[:, j] - somme[:, i]
+
+
+# headline KPIs of the country and every region in one vectorized pass: one row per area as in aree, columns as in kpi_colonne
+def kpi_table(reg_dosi, reg_forn_dosi, dc, dpc, dg, dim_regioni, regions, today):
+    oggi = str(today)
+    # each dose in its campaign window, Janssen single doses and deliveries from their running totals
+    dosi_prefix = area_prefix_sums(reg_dosi[[col for nome, col, inizio in kpi_dosi]],
+                                   reg_dosi.index.get_level_values('reg'), reg_dosi.index.get_level_values('data'), regions)
+    janssen = reg_forn_dosi.xs('Janssen', level='forn')
+    janssen_prefix = area_prefix_sums(janssen[['d1']], janssen.index.get_level_values('reg'), janssen.index.get_level_values('data'), regions)
+    consegne_prefix = area_prefix_sums(dc[['numero_dosi']], dc['reg'], dc['data_consegna'].str[:10], regions)
+    tabella = pandas.DataFrame(numpy.column_stack(
+        [area_window_sum(dosi_prefix, inizio, oggi)[:, k] for k, (nome, col, inizio) in enumerate(kpi_dosi)]
+        + [area_window_sum(janssen_prefix, '2021-04-05', oggi)[:, 0], area_window_sum(consegne_prefix, '2020-12-27', oggi)[:, 0]]),
+        index=['Dato Nazionale'] + regions, columns=[nome for nome, col, inizio in kpi_dosi] + ['janssen', 'consegne']).astype('float64')
+    tabella['vaccinati'] = tabella['seconda'] + tabella['janssen'] + tabella['covid']  # add only 1 doses and whit covid
+    tabella['prima_bidose'] = tabella['prima'] - tabella['janssen']
+    # the healed are only published for the country
+    tabella['guariti_senza'] = tabella['guariti_con'] = numpy.nan
+    tabella.loc['Dato Nazionale', ['guariti_senza', 'guariti_con']] = dg['guariti_senza_somm'].sum(), dg['guariti_post_somm'].sum()
+    tabella['popolazione'] = [60360000] + regioni['popolazione'].reindex(regions).tolist()
+    tabella['platea'] = [50773718] + dim_regioni['platea'].reindex(regions).tolist()
+    for nome in kpi_percentuali:
+        tabella[nome + '_pop'] = (tabella[nome] / tabella['popolazione'] * 100).round(2)
+        tabella[nome + '_platea'] = (tabella[nome] / tabella['platea'] * 100).round(2)
+    # positives and deaths of the last month over the month before, the DPC data are stamped at 17:00 so a month runs up to the day before
+    ora = datetime.strptime(oggi, '%Y-%m-%d')
+    mese = ora - relativedelta(months=1)
+    colonne = ['nuovi_positivi', 'nuovi_decessi']
+    corrente = dpc.loc[(slice(None), slice(mese, ora - timedelta(days=1))), colonne].groupby(level='reg').sum()
+    precedente = dpc.loc[(slice(None), slice(mese - relativedelta(months=1), mese - timedelta(days=1))), colonne].groupby(level='reg').sum()
+    mese_su_mese = (corrente / precedente * 100).round(2).reindex(tabella.index)
+    tabella['positivi_mese'], tabella['decessi_mese'] = mese_su_mese['nuovi_positivi'], mese_su_mese['nuovi_decessi']
+    return tabella[kpi_colonne].to_numpy()
+
+
+# headline KPIs of an area ('Dato Nazionale' or a region), a read only record over its row
+def kpi(s, area):
+    return Kpi(*s.kpi[s.aree[area]].tolist())
+
+
+# forecast of the country and every region for all doses, targets and windows in one array pass:
+# cumulative doses per area and day, then the day each dose reaches each target at the pace of each trailing window;
+# the days are counted from 1970-01-01, a forecast may fall after the last datetime64[ns]
+def previsioni_table(reg_dosi, kpi_valori, regions, today):
+    ora = datetime.strptime(str(today), '%Y-%m-%d')
+    colonne = [col for nome, col, label, color, obiettivi in previsione_dosi]
+    # area x day x dose running totals, the national total is the first row
+    giorni, somme = prefix = area_prefix_sums(reg_dosi[colonne], reg_dosi.index.get_level_values('reg'), reg_dosi.index.get_level_values('data'), regions)
+    cumulate = somme[:, 1:]
+    # doses of each window, area x window x dose
+    inizi = [ora - finestra for label, finestra in previsione_finestre]
+    ritmo = numpy.stack([area_window_sum(prefix, inizio, ora) for inizio in inizi], axis=1).astype('float64')
+    passati = numpy.array([(ora - inizio).days for inizio in inizi])
+    # doses still missing for each target, area x dose x target
+    attuali = kpi_valori[:, [kpi_colonne.index(nome) for nome, col, label, color, obiettivi in previsione_dosi]]
+    popolazione = kpi_valori[:, kpi_colonne.index('popolazione')]
+    mancanti = numpy.round(numpy.array([obiettivi for nome, col, label, color, obiettivi in previsione_dosi]) * popolazione[:, None, None]) - attuali[:, :, None]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        durata = mancanti[:, None] / ritmo[:, :, :, None] * passati[None, :, None, None]
+    # a dose starts once the ones before it reached the same target
+    durata = durata.cumsum(axis=2)
+    # no pace or a day out of the calendar: no date
+    valide = numpy.isfinite(durata) & (durata > (datetime.min - ora).days) & (durata < (datetime.max - ora).days)
+    arrivi = numpy.full(durata.shape, numpy.nan)
+    micro = numpy.round(durata[valide] * 86400e6).astype('int64').astype('timedelta64[us]')
+    arrivi[valide] = (numpy.datetime64(ora, 'us') + micro).astype('datetime64[D]').astype('int64')
+    return Previsioni(giorni=giorni.rename('giorno'), cumulate=cumulate, date=arrivi)
+
+
+# forecast of a snapshot from its tables: areas x days x doses running totals, arrival days as text or None
+def previsioni_arrays(cumulate, arrivi):
+    date_arrivo = numpy.full(arrivi.shape, None, dtype=object)
+    noti = ~numpy.isnan(arrivi)
+    date_arrivo[noti] = numpy.datetime_as_string(arrivi[noti].astype('int64').astype('datetime64[D]'))
+    forma = (len(cumulate.index), -1, len(previsione_dosi))
+    return Previsioni(giorni=cumulate.index, cumulate=cumulate.to_numpy().reshape(forma).transpose(1, 0, 2), date=date_arrivo)
+
+
+# derived tables of a snapshot, computed once per refresh: dates as datetime64 and regions and suppliers as categoricals,
+# so the publisher can write them as feather and every reader maps them without copying
+def derive_tables(new_frames, new_today):
+    new_dc, new_cube, new_ddcr, new_dfe, new_dg = new_frames['dc'], new_frames['cube'], new_frames['ddcr'], new_frames['dfe'], new_frames['dg']
+    new_dpc = dpc_table(new_frames['ddc'], new_ddcr)
+    new_regions = new_cube['reg'].drop_duplicates().tolist()  # all regions
+    new_aree = {reg: i for i, reg in enumerate(['Dato Nazionale'] + new_regions)}  # row of an area in the per area arrays
+
+    # doses delivered, in total and by region
+    consegne = new_dc.assign(reg=new_dc['reg'].astype('category'), data_consegna=pandas.to_datetime(new_dc['data_consegna'].str[:10]))
+    new_dc_reg = consegne.groupby(['reg', 'data_consegna'], observed=True)[['numero_dosi']].sum()
+    new_dc = date_indexed(consegne.groupby('data_consegna')[['numero_dosi']].sum().reset_index(), 'data_consegna')
+    # rollups of the cube read by the charts, observed groupbys on categoricals keep appearance order so sort them
+    new_reg_forn_dosi = new_frames['reg_forn_dosi'].set_index(['reg', 'forn', 'data']).sort_index()
+    new_reg_dosi = new_reg_forn_dosi.groupby(level=['reg', 'data'], observed=True).sum().sort_index()
+    new_reg_eta = new_frames['reg_eta'].set_index(['reg', 'eta']).sort_index()
+    new_forn_dosi = new_reg_forn_dosi.groupby(level=['forn', 'data'], observed=True).sum().sort_index()
+    new_ds_dosi = date_indexed(new_reg_dosi.groupby(level='data', observed=True).sum().sort_index().reset_index())
 
     #last update date
-    ds_prime_dosi = ds_dosi.loc[ds_dosi['data'] == str(today), 'd1']
-    if len(ds_prime_dosi) == 0: last_update = date.today()
-    else: last_update = date.today() - timedelta(days=1)
+    if pandas.Timestamp(new_today) not in new_ds_dosi.index: new_last_update = date.today()
+    else: new_last_update = date.today() - timedelta(days=1)
     # max first
-    max_prima = int(max(ds_dosi['d1']))
-    max_prima_f = '{:,}'.format(max_prima).replace(',', '.')  # format max first dose
-    # percentage death-positive
+    max_prima = int(max(new_ds_dosi['d1']))
+    new_max_prima_f = '{:,}'.format(max_prima).replace(',', '.')  # format max first dose
     date_format = "%Y-%m-%d"  # date format
-    ora = datetime.strptime(str(today), date_format)
-    mese = ora - relativedelta(months=1)
-    # positive
-    month_prima_p = ddc.loc[ddc['data'].between(str(mese)[:10], str(ora)[:10]), ['nuovi_positivi']].sum()
-    month_pprima_p = ddc.loc[ddc['data'].between(str(mese - relativedelta(months=1))[:10], str(mese)[:10]), ['nuovi_positivi']].sum()
-    percent_mese = round((int(month_prima_p) / month_pprima_p) * 100, 2)
-    # death
-    ddc['nuovi_decessi'] = ddc.deceduti.diff().fillna(ddc.deceduti)
-    month_prima_d = ddc.loc[ddc['data'].between(str(mese)[:10], str(ora)[:10]), ['nuovi_decessi']].sum()
-    month_pprima_d = ddc.loc[ddc['data'].between(str(mese - relativedelta(months=1))[:10], str(mese)[:10]), ['nuovi_decessi']].sum()
-    percent_mese_death = round((int(month_prima_d) / month_pprima_d) * 100, 2)
-    # first dose from the start
-    tot_prima = ds_dosi.loc[ds_dosi['data'].between('2020-12-27', str(today)), ['d1']].sum()
-    tot_prima_dose = '{:,}'.format(int(tot_prima)).replace(',', '.')
-    # second dose from the start
-    tot_seconda = ds_dosi.loc[ds_dosi['data'].between('2020-12-27', str(today)), ['d2']].sum()
-    tot_seconda_dose = '{:,}'.format(int(tot_seconda)).replace(',', '.')
-    # third dose from the start
-    tot_terza = ds_dosi.loc[ds_dosi['data'].between('2021-09-15', str(today)), ['db1']].sum()
-    tot_terza_dose = '{:,}'.format(int(tot_terza)).replace(',', '.')
-    # third dose from the start
-    tot_quarta = ds_dosi.loc[ds_dosi['data'].between('2022-02-01', str(today)), ['db2']].sum()
-    tot_quarta_dose = '{:,}'.format(int(tot_quarta)).replace(',', '.')
-    # with covid
-    tot_covid = ds_dosi.loc[ds_dosi['data'].between('2020-12-27', str(today)), ['dpi']].sum()
-    tot_with_covid = '{:,}'.format(int(tot_covid)).replace(',', '.')
-    # healed
-    healed_no = dg['guariti_senza_somm'].sum()
-    healed_with = dg['guariti_post_somm'].sum()
-    # age
-    dfa = ds.groupby('eta').agg({'d1': 'sum', 'd2': 'sum', 'db1': 'sum', 'db2': 'sum'}).reset_index()
-    tot_dfe = dfe.groupby('eta').agg({'totale_popolazione': 'sum'}).reset_index()
+    ora = datetime.strptime(str(new_today), date_format)
+    # total doses per day and region on a contiguous date range, the comparison chart gathers its columns
+    giorni = pandas.date_range(new_ds_dosi['data'].min(), new_ds_dosi['data'].max())
+    new_dosi_regioni = new_reg_dosi[['d1', 'd2', 'db1', 'db2']].sum(axis=1).unstack('reg', fill_value=0)
+    new_dosi_regioni.columns = new_dosi_regioni.columns.astype(str)
+    new_dosi_regioni = new_dosi_regioni.reindex(giorni, fill_value=0).rename_axis('data').reset_index()
+    # age: doses and platea per region and age group, one row per area and the national total first
+    chiavi = pandas.MultiIndex.from_product([new_regions, eta_gruppi], names=['reg', 'eta'])
+    dosi_eta = new_reg_eta.reset_index().astype({'reg': str, 'eta': str}).set_index(['reg', 'eta'])[dosi].reindex(chiavi, fill_value=0)
+    platea_eta = (new_dfe.assign(reg=new_dfe['area'].map(regioni.reset_index().set_index('area')['reg']))
+                  .groupby(['reg', 'eta'])['totale_popolazione'].sum().reindex(chiavi, fill_value=0))
+    valori = numpy.column_stack([dosi_eta.to_numpy(), platea_eta.to_numpy()]).astype('int64').reshape(len(new_regions), len(eta_gruppi), len(eta_colonne))
+    new_eta = pandas.DataFrame(numpy.concatenate([valori.sum(axis=0, keepdims=True), valori]).reshape(len(new_aree), -1),
+                               columns=[gruppo + ' ' + col for gruppo in eta_gruppi for col in eta_colonne])
+    # region dimension with the platea of this snapshot
+    new_dim_regioni = regioni.assign(platea=new_dfe.groupby('area')['totale_popolazione'].sum().reindex(regioni['area']).values)
+    # last week per 100.000 inhabitants and vaccinated percentage, all regions in one pass over the sorted DPC table
+    incidenze = [col + '_100k' for col in dpc_incidenze]
+    week = new_dpc.loc[(slice(None), slice(ora - timedelta(days=7), ora - timedelta(days=1))), incidenze].groupby(level='reg').sum()
+    dim = new_dim_regioni.reindex(new_regions)
+    new_riduzione = week.reindex(new_regions).set_axis(list(dpc_incidenze.values()), axis=1).round(2).clip(lower=0)
+    new_riduzione.index = dim['denominazione_regione']
+    new_riduzione['vaccinati'] = (new_reg_dosi['d2'].groupby(level='reg', observed=True).sum().reindex(new_regions).values / dim['popolazione'].values * 100).round(2)
+    new_kpi = kpi_table(new_reg_dosi, new_reg_forn_dosi, new_frames['dc'], new_dpc, new_dg, new_dim_regioni, new_regions, new_today)
+    new_previsioni = previsioni_table(new_reg_dosi, new_kpi, new_regions, new_today)
+    colonne = [col for nome, col, label, color, obiettivi in previsione_dosi]
+    obiettivi = range(new_previsioni.date.shape[-1])
+
+    tables = {
+        'dc': new_dc, 'dc_reg': new_dc_reg, 'dpc': new_dpc, 'ds_dosi': new_ds_dosi, 'forn_dosi': new_forn_dosi, 'reg_dosi': new_reg_dosi,
+        'reg_forn_dosi': new_reg_forn_dosi, 'riduzione': new_riduzione, 'dim_regioni': new_dim_regioni, 'eta': new_eta,
+        'dosi_regioni': new_dosi_regioni, 'kpi': pandas.DataFrame(new_kpi, columns=kpi_colonne),
+        'cumulate': pandas.DataFrame(new_previsioni.cumulate.transpose(1, 0, 2).reshape(len(new_previsioni.giorni), -1), index=new_previsioni.giorni,
+                                     columns=[area + ' ' + col for area in new_aree for col in colonne]),
+        'arrivi': pandas.DataFrame(new_previsioni.date.reshape(len(new_aree), -1),
+                                   columns=[finestra + ' ' + col + ' ' + str(i) for finestra, lunghezza in previsione_finestre for col in colonne for i in obiettivi])}
+    meta = {'today': str(new_today), 'last_update': str(new_last_update), 'max_prima_f': new_max_prima_f, 'regions': new_regions}
+    return tables, meta
+
+
+# snapshot over the derived tables, only the per region slices and the small arrays are built here
+def snapshot_from_tables(tables, meta, new_data_version):
+    new_regions = meta['regions']
+    new_aree = {reg: i for i, reg in enumerate(['Dato Nazionale'] + new_regions)}
+    new_dc_reg, new_dpc, new_reg_dosi = tables['dc_reg'], tables['dpc'], tables['reg_dosi']
+    arrivi = tables['arrivi'].to_numpy().reshape(len(new_aree), len(previsione_finestre), len(previsione_dosi), -1)
+    return Snapshot(
+        version=new_data_version, today=date.fromisoformat(meta['today']), last_update=date.fromisoformat(meta['last_update']),
+        max_prima_f=meta['max_prima_f'], regions=new_regions, aree=new_aree, dc=tables['dc'],
+        # split by region once, the dropdown callbacks only look up their slice
+        dc_reg={reg: date_indexed(cube_slice(new_dc_reg, reg), 'data_consegna') for reg in new_dc_reg.index.get_level_values('reg').unique()},
+        ddc=new_dpc.loc['Dato Nazionale'], dpc=new_dpc, ds_dosi=tables['ds_dosi'],
+        ds_reg={reg: date_indexed(cube_slice(new_reg_dosi, reg)) for reg in new_regions},
+        forn_dosi=tables['forn_dosi'], reg_dosi=new_reg_dosi, reg_forn_dosi=tables['reg_forn_dosi'], riduzione=tables['riduzione'],
+        dim_regioni=tables['dim_regioni'], eta_valori=tables['eta'].to_numpy().reshape(len(new_aree), len(eta_gruppi), len(eta_colonne)),
+        dosi_regioni=tables['dosi_regioni'], kpi=tables['kpi'].to_numpy(), previsioni=previsioni_arrays(tables['cumulate'], arrivi))
+
+
+# publish a new snapshot with one reference swap
+def publish_snapshot(new_snapshot, new_frames):
+    global data_version, frames, snapshot
+    with refresh_lock:
+        figure_cache.clear()  # figures of the old data
+        response_cache.clear()
+        data_version, frames, snapshot = new_snapshot.version, new_frames, new_snapshot
+
+
+# derived data of a snapshot, built in process
+def build_data(new_frames, new_data_version):
+    tables, meta = derive_tables(new_frames, new_data_version[1])
+    publish_snapshot(snapshot_from_tables(tables, meta, new_data_version), new_frames)
+
+
+# background refresh, keeps the last good data if upstream fails
+def refresh_loop():
+    while True:
+        try:
+            if refresh_mode == 'reader':
+                reload_snapshot()
+            else:
+                refresh_data()
+        except Exception:
+            logger.exception('refresh failed, keeping the last good data')
+        time.sleep(snapshot_poll if refresh_mode == 'reader' else refresh_interval)
+
+
+# frame indexed by the day of its date column, sorted so that time windows are binary searches
+def date_indexed(frame, col='data'):
+    frame = frame.set_index(pandas.DatetimeIndex(frame[col], name='giorno').normalize())
+    return frame if frame.index.is_monotonic_increasing else frame.sort_index(kind='stable')
+
+
+# values of a column on one day of a date indexed frame, empty when the day is missing
+def day_rows(frame, day, col):
+    return frame.loc[str(day)[:10]:str(day)[:10], col]
+
+
+# slice of a rollup on its first level, empty when the key is missing
+def cube_slice(rollup, key):
+    try:
+        return rollup.loc[key].reset_index()
+    except KeyError:
+        return rollup.iloc[:0].droplevel(0).reset_index()
+
+
+# series of the age chart for one or more rows ('Dato Nazionale' or regions) in one pass, rows x series x bands
+def age_bands(s, righe):
+    valori = s.eta_valori[[s.aree[riga] for riga in righe]]
+    return numpy.einsum('bg,rgc,sc->rsb', eta_bande, valori, eta_coeff)
+
+
+# daily rows on a contiguous range, days missing from the data count zero
+def daily_frame(frame):
+    giorni = frame['data'].dt.normalize()
+    if (giorni.diff().iloc[1:] == pandas.Timedelta(days=1)).all():
+        return frame
+    full = pandas.date_range(giorni.min(), giorni.max())
+    frame = frame.set_index(giorni).reindex(full, fill_value=0).reset_index(drop=True)
+    frame['data'] = full
+    return frame
+
+
+# doses per day of some regions, gathered from the date x region matrix and transformed for all of them at once:
+# per 100.000 inhabitants, 7 day rolling mean, then resampled to freq
+def confronto_regioni(s, regione, opzioni, freq):
+    confronto = s.dosi_regioni[['data'] + regione]
+    if 'abitanti' in opzioni:
+        confronto[regione] = (confronto[regione] * 100000 / s.dim_regioni.loc[regione, 'popolazione'].to_numpy()).round(1)
+    if 'media' in opzioni:
+        confronto[regione] = confronto[regione].rolling(7).mean().round(1)
+    return resample_frame(confronto, freq, regione)
+
+
+# per-day means of a daily frame over weeks (W) or months (M), dated by the first day of the period
+def resample_frame(frame, freq, columns):
+    if freq == 'D' or len(frame) == 0:
+        return frame
+    periodi = frame['data'].dt.to_period(freq)
+    frame = frame[columns].groupby(periodi.values).mean().round(1)
+    frame['data'] = frame.index.start_time.strftime('%Y-%m-%d')
+    return frame.reset_index(drop=True)
+
+
+# x of a daily or weekly frame as first day and step, plotly spaces the points itself; months are uneven
+def series_x(frame, freq='D'):
+    if len(frame) == 0:
+        return {'x': []}
+    if freq == 'M':
+        return {'x': frame['data'].tolist()}
+    return {'x0': date_label(frame['data'].iloc[0]), 'dx': day_ms * (7 if freq == 'W' else 1)}
+
+
+# a date as plotly gets it, the day alone at midnight; resampled frames are already dated as text
+def date_label(giorno):
+    if isinstance(giorno, str):
+        return giorno
+    return giorno.strftime('%Y-%m-%d') if giorno == giorno.normalize() else giorno.isoformat()
+
+
+# period of the time series points for a window of days
+def resolution(days):
+    for giorni, freq in risoluzioni:
+        if giorni is None or days <= giorni:
+            return freq
+
+
+# days of the x range shown after a relayout, None when autoranged; other relayouts leave the data alone
+def zoom_days(relayout):
+    relayout = relayout or {}
+    if 'xaxis.range' in relayout:
+        start, end = relayout['xaxis.range']
+    elif 'xaxis.range[0]' in relayout and 'xaxis.range[1]' in relayout:
+        start, end = relayout['xaxis.range[0]'], relayout['xaxis.range[1]']
+    elif relayout.get('xaxis.autorange'):
+        return None
+    else:
+        raise PreventUpdate
+    return (pandas.Timestamp(end) - pandas.Timestamp(start)).days
+
+
+# memoize a dropdown callback on its input and the data version, LRU with TTL
+def cached_figure(callback):
+    @functools.wraps(callback)
+    def wrapper(*args):
+        key = (callback.__name__, json.dumps(args), snapshot.version)
+        with refresh_lock:
+            hit = figure_cache.get(key)
+            if hit is not None and time.time() - hit[0] < figure_cache_ttl:
+                figure_cache.move_to_end(key)
+                return hit[1]
+        output = callback(*args)
+        with refresh_lock:
+            figure_cache[key] = (time.time(), output)
+            figure_cache.move_to_end(key)
+            while len(figure_cache) > figure_cache_size:
+                figure_cache.popitem(last=False)
+        return output
+    return wrapper
+
+
+# true when the client already has the response tagged etag, tags are suffixed with the encoding
+def not_modified(etag):
+    return etag in {tag.split(':')[0] for tag in flask.request.if_none_match.as_set()}
+
+
+# a body in every encoding we serve, compressed once when it is stored
+def encode_body(body):
+    return {'identity': body, 'gzip': gzip.compress(body, compresslevel=9), 'br': brotli.compress(body, quality=brotli_quality)}
+
+
+# stored encoding the client prefers, brotli first on ties
+def best_encoding():
+    return flask.request.accept_encodings.best_match(['br', 'gzip'])
+
+
+# headers a response and its 304 share: the tag of the encoded variant, Vary and the caching policy
+def tag_variant(response, encoding, etag, cache_control):
+    if etag is not None:
+        response.set_etag(etag + ':' + encoding if encoding else etag)
+    response.vary.add('Accept-Encoding')
+    if cache_control is not None:
+        response.headers['Cache-Control'] = cache_control
+    return response
+
+
+# response with the stored encoding the client prefers; tagged for revalidation when etag is given
+def encoded_response(variants, mimetype, etag=None, cache_control=None, response=None):
+    encoding = best_encoding()
+    if response is None:
+        response = flask.Response(mimetype=mimetype)
+    response.set_data(variants[encoding or 'identity'])
+    if encoding:
+        response.headers['Content-Encoding'] = encoding  # the per request compression leaves it alone
+    return tag_variant(response, encoding, etag, cache_control)
+
+
+# 304 with the same validator and caching headers as the 200 it stands for
+def not_modified_response(etag, cache_control):
+    return tag_variant(flask.Response(status=304), best_encoding(), etag, cache_control)
+
+
+# callback responses are stored by data version and request body, repeats get the stored body;
+# dash posts its callbacks, so browsers and proxies do not cache them: no ETag or Cache-Control, only this in process LRU
+@server.before_request
+def cached_response():
+    if flask.request.method != 'POST' or not flask.request.path.endswith('/_dash-update-component'):
+        return None
+    flask.g.version = snapshot.version
+    flask.g.response_key = hashlib.sha1(repr(flask.g.version).encode() + flask.request.get_data()).hexdigest()
+    with refresh_lock:
+        variants = response_cache.get(flask.g.response_key)
+        if variants is None:
+            return None
+        response_cache.move_to_end(flask.g.response_key)
+    flask.g.cached = True
+    return encoded_response(variants, 'application/json')
+
+
+@server.after_request
+def store_response(response):
+    if 'response_key' not in flask.g or 'cached' in flask.g or response.status_code != 200:
+        return response
+    variants = encode_body(response.get_data())
+    if flask.g.version == snapshot.version:
+        with refresh_lock:
+            response_cache[flask.g.response_key] = variants
+            while len(response_cache) > response_cache_size:
+                response_cache.popitem(last=False)
+    return encoded_response(variants, None, response=response)
+
+
+# the layout is the same for every visitor of a snapshot: serialize and compress it once per data version
+@server.before_request
+def cached_layout():
+    global layout_cache
+    if flask.request.method != 'GET' or not flask.request.path.endswith('/_dash-layout'):
+        return None
+    hit = layout_cache
+    if hit is None or hit[0] != snapshot.version:
+        version = snapshot.version
+        variants = encode_body(json.dumps(app._layout_value(), cls=plotly.utils.PlotlyJSONEncoder).encode())
+        hit = layout_cache = (version, hashlib.sha1(repr(version).encode()).hexdigest(), variants)
+    if not_modified(hit[1]):
+        return not_modified_response(hit[1], 'no-cache')
+    return encoded_response(hit[2], 'application/json', hit[1], 'no-cache')  # revalidate, the tag changes with the snapshot
+
+
+# text assets compressed once per file version, the rest is left to dash
+@server.before_request
+def compressed_asset():
+    prefix = app.config.requests_pathname_prefix + 'assets/'
+    if flask.request.method != 'GET' or not flask.request.path.startswith(prefix):
+        return None
+    name = flask.request.path[len(prefix):]
+    path = os.path.realpath(os.path.join(app.config.assets_folder, name))
+    mimetype = mimetypes.guess_type(name)[0]
+    if mimetype not in compressed_mimetypes or not path.startswith(os.path.realpath(app.config.assets_folder) + os.sep) or not os.path.isfile(path):
+        return None
+    mtime = os.path.getmtime(path)
+    hit = asset_cache.get(name)
+    if hit is None or hit[0] != mtime:
+        with open(path, 'rb') as f:
+            body = f.read()
+        hit = asset_cache[name] = (mtime, hashlib.sha1(body).hexdigest(), encode_body(body))
+    cache_control = 'public, max-age=%d' % asset_max_age
+    if not_modified(hit[1]):
+        return not_modified_response(hit[1], cache_control)
+    return encoded_response(hit[2], mimetype, hit[1], cache_control)
+
+
+# start from the last snapshot if there is one, the refresh thread revalidates it
+if refresh_mode == 'publisher':
+    snapshot_frames, snapshot_digests = load_snapshot()
+    if snapshot_frames is not None:
+        # do not parse again what is already published, the next delta applies to it
+        data_version, frames = (snapshot_digests, None), snapshot_frames
+elif refresh_mode == 'reader':
+    snapshot_tables, snapshot_current = load_derived()
+    deadline = time.time() + snapshot_wait
+    while snapshot_tables is None:  # wait for the refresher process
+        if time.time() > deadline:
+            raise RuntimeError('no snapshot published in %s after %d seconds, is the refresher process running?' % (snapshot_dir, snapshot_wait))
+        time.sleep(1)
+        snapshot_tables, snapshot_current = load_derived()
+    publish_snapshot(snapshot_from_tables(snapshot_tables, snapshot_current, derived_version(snapshot_current)), {})
+    threading.Thread(target=refresh_loop, name='refresh_data', daemon=True).start()
+else:
+    snapshot_frames, snapshot_digests = load_snapshot()
+    if snapshot_frames is None:
+        refresh_data()
+    else:
+        build_data(snapshot_frames, (snapshot_digests, date.today()))
+    threading.Thread(target=refresh_loop, name='refresh_data', daemon=True).start()
 
 
 # dropdown
-def get_dropdown_data():
+def get_dropdown_data(s):
     selections = []
     selections.append(dict(label='Dato Nazionale', value='Dato Nazionale'))
-    for reg in regions:
+    for reg in s.regions:
         selections.append(dict(label=reg, value=reg))
     return selections
 
 
 # total vaccine status
-def vaccine_update():
-    global primadose, secondadose, terzadose, quartadose
-    janssen = ds.loc[ds['forn'] == 'Janssen'].groupby('data').agg({'d1': 'sum'}).reset_index()
-    tot_janssen = janssen.loc[janssen['data'].between('2021-04-05', str(today)), ['d1']].sum()
+def vaccine_update(k):
     # percentage
-    prima = int(tot_prima) - int(tot_janssen)
-    primadose = round((int(prima) / 60360000) * 100, 2)
-    t_secondadose = int(tot_seconda) + int(tot_janssen) + int(tot_covid)  # add only 1 doses and whit covid
-    secondadose = round((int(t_secondadose)/60360000)*100, 2)
-    terza = int(tot_terza)
-    terzadose = round((int(terza) / 60360000) * 100, 2)
-    quarta = int(tot_quarta)
-    quartadose = round((int(quarta) / 60360000) * 100, 2)
+    primadose, secondadose, terzadose, quartadose = k.prima_bidose_pop, k.vaccinati_pop, k.terza_pop, k.quarta_pop
     # percentage platea
-    p_primadose = round((int(prima) / 50773718) * 100, 2)
-    p_secondadose = round((int(t_secondadose) / 50773718) * 100, 2)
-    p_terzadose = round((int(terza) / 50773718) * 100, 2)
-    p_quartadose = round((int(quarta) / 50773718) * 100, 2)
+    p_primadose, p_secondadose, p_terzadose, p_quartadose = k.prima_bidose_platea, k.vaccinati_platea, k.terza_platea, k.quarta_platea
     # formating
-    tot_prima_dose = '{:,}'.format(int(prima)).replace(',', '.')
-    tot_seconda_dose = '{:,}'.format(int(t_secondadose)).replace(',', '.')
-    tot_terza_dose = '{:,}'.format(int(terza)).replace(',', '.')
-    tot_quarta_dose = '{:,}'.format(int(quarta)).replace(',', '.')
+    tot_prima_dose = '{:,}'.format(int(k.prima_bidose)).replace(',', '.')
+    tot_seconda_dose = '{:,}'.format(int(k.vaccinati)).replace(',', '.')
+    tot_terza_dose = '{:,}'.format(int(k.terza)).replace(',', '.')
+    tot_quarta_dose = '{:,}'.format(int(k.quarta)).replace(',', '.')
 
     return html.Div([
         html.Div([
@@ -253,19 +1022,14 @@ def vaccine_update():
 
 
 # total vaccine status
-def vaccine_update_mono():
-    global tot_janssen, tot_janssenf, primadose, secondadose
+def vaccine_update_mono(k):
     # percentage
-    janssen = ds.loc[ds['forn'] == 'Janssen'].groupby('data').agg({'d1': 'sum'}).reset_index()
-    tot_janssen = janssen.loc[janssen['data'].between('2021-04-05', str(today)), ['d1']].sum()
-    tjanssen = round((int(tot_janssen) / 60360000) * 100, 2)
-    covid = round((int(tot_covid) / 60360000) * 100, 2)
+    tjanssen, covid = k.janssen_pop, k.covid_pop
     # percentage platea
-    p_tjanssen = round((int(tot_janssen) / 50773718) * 100, 2)
-    p_covid = round((int(tot_covid) / 50773718) * 100, 2)
+    p_tjanssen, p_covid = k.janssen_platea, k.covid_platea
     # formating
-    tot_janssenf = '{:,}'.format(int(tot_janssen)).replace(',', '.')
-    tot_covid_dosi = '{:,}'.format(int(tot_covid)).replace(',', '.')
+    tot_janssenf = '{:,}'.format(int(k.janssen)).replace(',', '.')
+    tot_covid_dosi = '{:,}'.format(int(k.covid)).replace(',', '.')
     return html.Div([
         html.Div([
             html.Table([
@@ -302,16 +1066,14 @@ def vaccine_update_mono():
 
 
 # total vaccine status
-def vaccine_healed():
+def vaccine_healed(k):
     # percentage
-    t_healed_no = round((int(healed_no) / 60360000) * 100, 2)
-    t_healed_with = round((int(healed_with) / 60360000) * 100, 2)
+    t_healed_no, t_healed_with = k.guariti_senza_pop, k.guariti_con_pop
     # percentage platea
-    p_healed_no = round((int(healed_no) / 50773718) * 100, 2)
-    p_healed_with = round((int(healed_with) / 50773718) * 100, 2)
+    p_healed_no, p_healed_with = k.guariti_senza_platea, k.guariti_con_platea
     # formating
-    tot_healed_no = '{:,}'.format(int(healed_no)).replace(',', '.')
-    tot_healed_with = '{:,}'.format(int(healed_with)).replace(',', '.')
+    tot_healed_no = '{:,}'.format(int(k.guariti_senza)).replace(',', '.')
+    tot_healed_with = '{:,}'.format(int(k.guariti_con)).replace(',', '.')
     return html.Div([
         html.Div([
             html.Table([
@@ -346,12 +1108,12 @@ def vaccine_healed():
         ], className='container-2'),
     ], className='container-1')
 
-def vaccine_update_bar():
+def vaccine_update_bar(k):
     return html.Div([
         html.Div([
             dcc.Graph(
                 figure={
-                    'data': [go.Bar(x=[60360000, 50773718, int(tot_seconda)+int(tot_janssen)+int(tot_covid), int(tot_prima)-int(tot_janssen), int(tot_terza), int(tot_quarta)],
+                    'data': [go.Bar(x=[int(k.popolazione), int(k.platea), int(k.vaccinati), int(k.prima_bidose), int(k.terza), int(k.quarta)],
                                     y=['Popolazione', 'Platea', 'Vaccinati', 'Prima dose', 'Terza dose', 'Quarta dose'],
                                     orientation='h',
                                     marker_color=['#6181E8', '#5EAEFF', '#E83A8E', '#F5C05F', '#B768FE', '#5B3EAB'])
@@ -367,14 +1129,14 @@ def vaccine_update_bar():
 
 
 # dropdown select
-def dropdown_vaccine_daily():
+def dropdown_vaccine_daily(s):
     return html.Div([
         html.Div([
             dbc.Container([
                 dbc.Row([
                     dbc.Col(
                         dcc.Dropdown(id='dropdown_vaccine_daily',
-                                     options=get_dropdown_data(), clearable=False, searchable=False,
+                                     options=get_dropdown_data(s), clearable=False, searchable=False,
                                      persistence=True, persistence_type='session', value='Dato Nazionale'),
                         style={'margin-left': 'auto', 'margin-right': 'auto'}, width=12, lg=5, className='mt-2'
                     )
@@ -384,53 +1146,43 @@ def dropdown_vaccine_daily():
     ])
 
 
-# vaccine horozzonatal bar
+# administrations, deliveries and doses by supplier of an area, the one slice of the data read by the daily panels
+def vaccine_slice(s, regione):
+    if regione == 'Dato Nazionale':
+        return s.ds_dosi, s.dc, s.forn_dosi
+    return s.ds_reg[regione], s.dc_reg[regione], s.reg_forn_dosi.loc[regione]
+
+
+# daily data, vaccines and doses of the selected area in one round trip, all built from one slice
 @app.callback(
-    Output('vaccine_daily', 'children'),
+    [Output('vaccine_daily', 'children'), Output('vaccine_graph', 'children'), Output('dosi_graph', 'children')],
     [Input('dropdown_vaccine_daily', 'value')])
-def vaccine_daily(regione):
-    if regione == 'Dato Nazionale':
-        tot_consegne = dc.loc[dc['data_consegna'].between('2020-12-27', str(today)), ['numero_dosi']].sum()
-        tot_vaccini = int(tot_prima) + int(tot_seconda)
-        # today data
-        dc_dosi_consegnate = dc.loc[dc['data_consegna'] == str(today), 'numero_dosi']
-        ds_prime_dosi = ds_dosi.loc[ds_dosi['data'] == str(today), 'd1']
-        ds_seconde_dosi = ds_dosi.loc[ds_dosi['data'] == str(today), 'd2']
-        ds_terze_dosi = ds_dosi.loc[ds_dosi['data'] == str(today), 'db1']
-        ds_quarte_dosi = ds_dosi.loc[ds_dosi['data'] == str(today), 'db2']
-        # check today data
-        if len(dc_dosi_consegnate) == 0 and len(ds_prime_dosi) == 0 and len(ds_seconde_dosi) == 0:
-            dc_dosi_consegnate = dc.loc[dc['data_consegna'] == str(date.today() - timedelta(days=1)), 'numero_dosi']
-            ds_prime_dosi = ds_dosi.loc[ds_dosi['data'] == str(date.today() - timedelta(days=1)), 'd1']
-            ds_seconde_dosi = ds_dosi.loc[ds_dosi['data'] == str(date.today() - timedelta(days=1)), 'd2']
-            ds_terze_dosi = ds_dosi.loc[ds_dosi['data'] == str(date.today() - timedelta(days=1)), 'db1']
-            ds_quarte_dosi = ds_dosi.loc[ds_dosi['data'] == str(date.today() - timedelta(days=1)), 'db2']
-    else:
-        dc1 = pandas.read_csv(consegne)
-        ds1 = pandas.read_csv(somministrazioni)
-        reg_ds1 = ds1.loc[ds1['reg'] == regione]
-        ds_dosi1 = reg_ds1.copy().groupby('data').agg({'d1': 'sum', 'd2': 'sum', 'db1': 'sum', 'db2': 'sum'}).reset_index()
-        tot_prima1 = ds_dosi1.loc[ds_dosi1['data'].between('2020-12-27', str(today)), ['d1']].sum()
-        tot_seconda1 = ds_dosi1.loc[ds_dosi1['data'].between('2020-12-27', str(today)), ['d2']].sum()
-        reg_dc1 = dc1.loc[dc1['reg'] == regione]
-        dc_dosi1 = reg_dc1.copy().groupby('data_consegna').agg({'numero_dosi': 'sum'}).reset_index()
-        # data
-        tot_consegne = dc_dosi1.loc[dc_dosi1['data_consegna'].between('2020-12-27', str(today)), ['numero_dosi']].sum()
-        tot_vaccini = int(tot_prima1) + int(tot_seconda1)
-        # today data
-        dc_dosi_consegnate = dc_dosi1.loc[dc_dosi1['data_consegna'] == str(today), 'numero_dosi']
-        ds_prime_dosi = ds_dosi1.loc[ds_dosi1['data'] == str(today), 'd1']
-        ds_seconde_dosi = ds_dosi1.loc[ds_dosi1['data'] == str(today), 'd2']
-        ds_terze_dosi = ds_dosi1.loc[ds_dosi1['data'] == str(today), 'db1']
-        ds_quarte_dosi = ds_dosi.loc[ds_dosi['data'] == str(today), 'db2']
-
-        # check today data
-        if len(dc_dosi_consegnate) == 0 and len(ds_prime_dosi) == 0 and len(ds_seconde_dosi) == 0:
-            dc_dosi_consegnate = dc1.loc[dc1['data_consegna'] == str(date.today() - timedelta(days=1)), 'numero_dosi']
-            ds_prime_dosi = ds_dosi1.loc[ds_dosi1['data'] == str(date.today() - timedelta(days=1)), 'd1']
-            ds_seconde_dosi = ds_dosi1.loc[ds_dosi1['data'] == str(date.today() - timedelta(days=1)), 'd2']
-            ds_terze_dosi = ds_dosi1.loc[ds_dosi1['data'] == str(date.today() - timedelta(days=1)), 'db1']
-            ds_quarte_dosi = ds_dosi.loc[ds_dosi['data'] == str(date.today() - timedelta(days=1)), 'db2']
+@cached_figure
+def vaccine_panels(regione):
+    s = snapshot
+    ds_area, dc_area, forn_area = vaccine_slice(s, regione)
+    freq = resolution(len(s.ds_dosi))
+    return vaccine_daily(s, regione, ds_area, dc_area), vaccine_graph(vaccine_chart(forn_area, freq)), dosi_graph(dosi_chart(ds_area, freq))
+
+
+# vaccine horozzonatal bar
+def vaccine_daily(s, regione, ds_area, dc_area):
+    k, italia = kpi(s, regione), kpi(s, 'Dato Nazionale')
+    tot_consegne = k.consegne
+    tot_vaccini = int(k.prima) + int(k.seconda)
+    # today data
+    dc_dosi_consegnate = day_rows(dc_area, s.today, 'numero_dosi')
+    ds_prime_dosi = day_rows(ds_area, s.today, 'd1')
+    ds_seconde_dosi = day_rows(ds_area, s.today, 'd2')
+    ds_terze_dosi = day_rows(ds_area, s.today, 'db1')
+    ds_quarte_dosi = day_rows(s.ds_dosi, s.today, 'db2')
+    # check today data
+    if len(dc_dosi_consegnate) == 0 and len(ds_prime_dosi) == 0 and len(ds_seconde_dosi) == 0:
+        dc_dosi_consegnate = day_rows(dc_area, date.today() - timedelta(days=1), 'numero_dosi')
+        ds_prime_dosi = day_rows(ds_area, date.today() - timedelta(days=1), 'd1')
+        ds_seconde_dosi = day_rows(ds_area, date.today() - timedelta(days=1), 'd2')
+        ds_terze_dosi = day_rows(ds_area, date.today() - timedelta(days=1), 'db1')
+        ds_quarte_dosi = day_rows(s.ds_dosi, date.today() - timedelta(days=1), 'db2')
     ds_dosi_totali = 0
     tot_consegne = '{:,}'.format(int(tot_consegne)).replace(',', '.')
     tot_vaccini = '{:,}'.format(int(tot_vaccini)).replace(',', '.')
@@ -481,7 +1233,7 @@ def vaccine_daily(regione):
                 # Yesterday
                 html.Tr([
                     html.Td(
-                        html.B('Totali: ' + str(tot_prima_dose), style={'color': '#F5C05F', 'font-size': '14px'})
+                        html.B('Totali: ' + '{:,}'.format(int(italia.prima)).replace(',', '.'), style={'color': '#F5C05F', 'font-size': '14px'})
                     )
                 ])
             ], className='table')
@@ -500,7 +1252,7 @@ def vaccine_daily(regione):
                 # Yesterday
                 html.Tr([
                     html.Td(
-                        html.B('Totali: ' + str(tot_seconda_dose), style={'color': '#E83A8E', 'font-size': '14px'})
+                        html.B('Totali: ' + '{:,}'.format(int(italia.seconda)).replace(',', '.'), style={'color': '#E83A8E', 'font-size': '14px'})
                     )
                 ])
             ], className='table')
@@ -519,7 +1271,7 @@ def vaccine_daily(regione):
                 # Yesterday
                 html.Tr([
                     html.Td(
-                        html.B('Totali: ' + str(tot_terza_dose), style={'color': '#B768FE', 'font-size': '14px'})
+                        html.B('Totali: ' + '{:,}'.format(int(italia.terza)).replace(',', '.'), style={'color': '#B768FE', 'font-size': '14px'})
                     )
                 ])
             ], className='table')
@@ -537,7 +1289,7 @@ def vaccine_daily(regione):
                 # Yesterday
                 html.Tr([
                     html.Td(
-                        html.B('Totali: ' + str(tot_quarta_dose), style={'color': '#5B3EAB', 'font-size': '14px'})
+                        html.B('Totali: ' + '{:,}'.format(int(italia.quarta)).replace(',', '.'), style={'color': '#5B3EAB', 'font-size': '14px'})
                     )
                 ])
             ], className='table')
@@ -581,78 +1333,14 @@ def vaccine_daily(regione):
     ], className='container-1')
 
 
-# vaccine horozzonatal bar
-@app.callback(
-    Output('vaccine_graph', 'children'),
-    [Input('dropdown_vaccine_daily', 'value')])
 # vaccine and doses graph
-def vaccine_graph(regione):
-    if regione == 'Dato Nazionale':
-        # vaccine
-        ds_pfizer = ds.loc[ds['forn'] == 'Pfizer/BioNTech'].groupby('data').agg(
-            {'d1': 'sum', 'd2': 'sum', 'db1': 'sum', 'db2': 'sum'}).reset_index()
-        ds_moderna = ds.loc[ds['forn'] == 'Moderna'].groupby('data').agg(
-            {'d1': 'sum', 'd2': 'sum', 'db1': 'sum', 'db2': 'sum'}).reset_index()
-        ds_astra = ds.loc[ds['forn'] == 'Vaxzevria (AstraZeneca)'].groupby('data').agg(
-            {'d1': 'sum', 'd2': 'sum', 'db1': 'sum', 'db2': 'sum'}).reset_index()
-        ds_janssen = ds.loc[ds['forn'] == 'Janssen'].groupby('data').agg(
-            {'d1': 'sum', 'd2': 'sum', 'db1': 'sum', 'db2': 'sum'}).reset_index()
-    else:
-        # vaccine
-        ds1 = pandas.read_csv(somministrazioni)
-        reg_ds1 = ds1.loc[ds1['reg'] == regione]
-        ds_dosi1 = reg_ds1.copy().groupby('data').agg(
-            {'d1': 'sum', 'd2': 'sum', 'db1': 'sum', 'db2': 'sum', 'forn': 'last'}).reset_index()
-        ds_pfizer = ds_dosi1.loc[ds_dosi1['forn'] == 'Pfizer/BioNTech'].groupby('data').agg(
-            {'d1': 'sum', 'd2': 'sum', 'db1': 'sum', 'db2': 'sum'}).reset_index()
-        ds_moderna = ds_dosi1.loc[ds_dosi1['forn'] == 'Moderna'].groupby('data').agg(
-            {'d1': 'sum', 'd2': 'sum', 'db1': 'sum', 'db2': 'sum'}).reset_index()
-        ds_astra = ds_dosi1.loc[ds_dosi1['forn'] == 'Vaxzevria (AstraZeneca)'].groupby('data').agg(
-            {'d1': 'sum', 'd2': 'sum', 'db1': 'sum', 'db2': 'sum'}).reset_index()
-        ds_janssen = ds_dosi1.loc[ds_dosi1['forn'] == 'Janssen'].groupby('data').agg(
-            {'d1': 'sum', 'd2': 'sum', 'db1': 'sum', 'db2': 'sum'}).reset_index()
+def vaccine_graph(figure):
     return html.Div([
         dbc.Container([
             dbc.Row(
                 dbc.Col(
                     dcc.Graph(
-                        figure={
-                            'data': [
-                                {'x': ds_astra['data'],
-                                 'y': ds_astra['d1'] + ds_astra['d2'] + ds_astra['db1'] + ds_astra['db2'],
-                                 'type': 'bar',
-                                 'name': 'AstraZeneca',
-                                 'marker': dict(color='#537BE0')},
-                                {'x': ds_pfizer['data'],
-                                 'y': ds_pfizer['d1'] + ds_pfizer['d2'] + ds_pfizer['db1'] + ds_pfizer['db2'],
-                                 'type': 'bar',
-                                 'name': 'Pfizer',
-                                 'marker': dict(color='#95A9DE')},
-                                {'x': ds_moderna['data'],
-                                 'y': ds_moderna['d1'] + ds_moderna['d2'] + ds_moderna['db1'] + ds_moderna['db2'],
-                                 'type': 'bar',
-                                 'name': 'Moderna',
-                                 'marker': dict(color='#395499')},
-                                {'x': ds_janssen['data'],
-                                 'y': ds_janssen['d1'] + ds_janssen['d2'] + ds_janssen['db1'] + ds_janssen['db2'],
-                                 'type': 'bar',
-                                 'name': 'Janssen',
-                                 'marker': dict(color='#243561')},
-                            ],
-                            'layout': {
-                                'barmode': 'stack',
-                                'xaxis': dict(
-                                    rangeselector=dict(buttons=slider_button),
-                                    rangeslider=dict(visible=False),
-                                    type='date'
-                                ),
-                                'legend': dict(
-                                    orientation="h",
-                                    xanchor="center",
-                                    x=0.5, y=-0.2
-                                )
-                            }
-                        }, config=chart_config
+                        id='vaccine_graph_figure', figure=figure, config=chart_config
                     )
                 )
             )
@@ -660,52 +1348,78 @@ def vaccine_graph(regione):
     ], className='container-2')
 
 
-# vaccine horozzonatal bar
+# weekly or monthly means when the visible window is wide, daily data when zoomed in
 @app.callback(
-    Output('dosi_graph', 'children'),
-    [Input('dropdown_vaccine_daily', 'value')])
+    Output('vaccine_graph_figure', 'figure'),
+    [Input('vaccine_graph_figure', 'relayoutData')],
+    [State('dropdown_vaccine_daily', 'value')],
+    prevent_initial_call=True)
+def vaccine_graph_zoom(relayout, regione):
+    s = snapshot
+    return vaccine_figure(regione, resolution(zoom_days(relayout) or len(s.ds_dosi)))
+
+
+# figure of a zoom, cached by area and resolution
+@cached_figure
+def vaccine_figure(regione, freq):
+    ds_area, dc_area, forn_area = vaccine_slice(snapshot, regione)
+    return vaccine_chart(forn_area, freq)
+
+
+# doses by supplier of an area
+def vaccine_chart(ds_forn, freq):
+    ds_pfizer = resample_frame(daily_frame(cube_slice(ds_forn, 'Pfizer/BioNTech')), freq, dosi)
+    ds_moderna = resample_frame(daily_frame(cube_slice(ds_forn, 'Moderna')), freq, dosi)
+    ds_astra = resample_frame(daily_frame(cube_slice(ds_forn, 'Vaxzevria (AstraZeneca)')), freq, dosi)
+    ds_janssen = resample_frame(daily_frame(cube_slice(ds_forn, 'Janssen')), freq, dosi)
+    return {
+        'data': [
+            {**series_x(ds_astra, freq),
+             'y': ds_astra['d1'] + ds_astra['d2'] + ds_astra['db1'] + ds_astra['db2'],
+             'type': 'bar',
+             'name': 'AstraZeneca',
+             'marker': dict(color='#537BE0')},
+            {**series_x(ds_pfizer, freq),
+             'y': ds_pfizer['d1'] + ds_pfizer['d2'] + ds_pfizer['db1'] + ds_pfizer['db2'],
+             'type': 'bar',
+             'name': 'Pfizer',
+             'marker': dict(color='#95A9DE')},
+            {**series_x(ds_moderna, freq),
+             'y': ds_moderna['d1'] + ds_moderna['d2'] + ds_moderna['db1'] + ds_moderna['db2'],
+             'type': 'bar',
+             'name': 'Moderna',
+             'marker': dict(color='#395499')},
+            {**series_x(ds_janssen, freq),
+             'y': ds_janssen['d1'] + ds_janssen['d2'] + ds_janssen['db1'] + ds_janssen['db2'],
+             'type': 'bar',
+             'name': 'Janssen',
+             'marker': dict(color='#243561')},
+        ],
+        'layout': {
+            'uirevision': True,  # keep the zoom when the resolution changes
+            'barmode': 'stack',
+            'xaxis': dict(
+                rangeselector=dict(buttons=slider_button),
+                rangeslider=dict(visible=False),
+                type='date'
+            ),
+            'legend': dict(
+                orientation="h",
+                xanchor="center",
+                x=0.5, y=-0.2
+            )
+        }
+    }
+
+
 # vaccine and doses graph
-def dosi_graph(regione):
-    if regione == 'Dato Nazionale':
-        prima_seconda = ds.groupby('data').agg({'d1': 'sum', 'd2': 'sum', 'db1': 'sum', 'db2': 'sum'}).reset_index()
-    else:
-        ds1 = pandas.read_csv(somministrazioni)
-        reg_ds1 = ds1.loc[ds1['reg'] == regione]
-        prima_seconda = reg_ds1.copy().groupby('data').agg({'d1': 'sum', 'd2': 'sum', 'db1': 'sum', 'db2': 'sum'}).reset_index()
+def dosi_graph(figure):
     return html.Div([
             dbc.Container([
                 dbc.Row(
                     dbc.Col(
                         dcc.Graph(
-                            figure={
-                                'data': [
-                                    go.Bar(x=prima_seconda['data'],
-                                           y=prima_seconda['d1'],
-                                           name='Prima Dose', marker=dict(color='#F5C05F')),
-                                    go.Bar(x=prima_seconda['data'],
-                                           y=prima_seconda['d2'],
-                                           name='Seconda Dose', marker=dict(color='#78F5B3')),
-                                    go.Bar(x=prima_seconda['data'],
-                                           y=prima_seconda['db1'],
-                                           name='Terza Dose', marker=dict(color='#B768FE')),
-                                    go.Bar(x=prima_seconda['data'],
-                                           y=prima_seconda['db2'],
-                                           name='Quarta Dose', marker=dict(color='#5B3EAB')),
-                                ],
-                                'layout': {
-                                    'barmode': 'stack',
-                                    'xaxis': dict(
-                                        rangeselector=dict(buttons=slider_button),
-                                        rangeslider=dict(visible=False),
-                                        type='date'
-                                    ),
-                                    'legend': dict(
-                                        orientation="h",
-                                        xanchor="center",
-                                        x=0.5, y=-0.2,
-                                    )
-                                }
-                            }, config=chart_config
+                            id='dosi_graph_figure', figure=figure, config=chart_config
                         )
                     )
                 )
@@ -713,15 +1427,68 @@ def dosi_graph(regione):
         ], className='container-2')
 
 
+# dosi zoom
+@app.callback(
+    Output('dosi_graph_figure', 'figure'),
+    [Input('dosi_graph_figure', 'relayoutData')],
+    [State('dropdown_vaccine_daily', 'value')],
+    prevent_initial_call=True)
+def dosi_graph_zoom(relayout, regione):
+    s = snapshot
+    return dosi_figure(regione, resolution(zoom_days(relayout) or len(s.ds_dosi)))
+
+
+# figure of a zoom, cached by area and resolution
+@cached_figure
+def dosi_figure(regione, freq):
+    ds_area, dc_area, forn_area = vaccine_slice(snapshot, regione)
+    return dosi_chart(ds_area, freq)
+
+
+# doses by type of an area
+def dosi_chart(ds_area, freq):
+    prima_seconda = resample_frame(daily_frame(ds_area), freq, dosi)
+    return {
+        'data': [
+            go.Bar(**series_x(prima_seconda, freq),
+                   y=prima_seconda['d1'],
+                   name='Prima Dose', marker=dict(color='#F5C05F')),
+            go.Bar(**series_x(prima_seconda, freq),
+                   y=prima_seconda['d2'],
+                   name='Seconda Dose', marker=dict(color='#78F5B3')),
+            go.Bar(**series_x(prima_seconda, freq),
+                   y=prima_seconda['db1'],
+                   name='Terza Dose', marker=dict(color='#B768FE')),
+            go.Bar(**series_x(prima_seconda, freq),
+                   y=prima_seconda['db2'],
+                   name='Quarta Dose', marker=dict(color='#5B3EAB')),
+        ],
+        'layout': {
+            'uirevision': True,
+            'barmode': 'stack',
+            'xaxis': dict(
+                rangeselector=dict(buttons=slider_button),
+                rangeslider=dict(visible=False),
+                type='date'
+            ),
+            'legend': dict(
+                orientation="h",
+                xanchor="center",
+                x=0.5, y=-0.2,
+            )
+        }
+    }
+
+
 # dropdown select
-def dropdown_vaccine_age_bar():
+def dropdown_vaccine_age_bar(s):
     return html.Div([
         html.Div([
             dbc.Container([
                 dbc.Row([
                     dbc.Col(
                         dcc.Dropdown(id='dropdown_vaccine_age_bar',
-                                     options=get_dropdown_data(), clearable=False, searchable=False,
+                                     options=get_dropdown_data(s), clearable=False, searchable=False,
                                      persistence=True, persistence_type='session', value='Dato Nazionale'),
                         style={'margin-left': 'auto', 'margin-right': 'auto'}, width=12, lg=5, className='mt-2'
                     )
@@ -735,176 +1502,28 @@ def dropdown_vaccine_age_bar():
 @app.callback(
     Output('vaccine_age_bar', 'children'),
     [Input('dropdown_vaccine_age_bar', 'value')])
+@cached_figure
 def vaccine_age_bar(regione):
-    if regione == 'Dato Nazionale':
-        figure_age = {
-            'data': [go.Bar(x=[int(dfa['d1'][0])-int(int(dfa['d2'][0])-int(dfa['db1'][0])-(int(dfa['db2'][0]))),
-                               int(dfa['d1'][1])-int(int(dfa['d2'][1])-int(dfa['db1'][1])-(int(dfa['db2'][1]))),
-                               int(dfa['d1'][2])-int(int(dfa['d2'][2])-int(dfa['db1'][2])-(int(dfa['db2'][2]))),
-                               int(dfa['d1'][3])-int(int(dfa['d2'][3])-int(dfa['db1'][3])-(int(dfa['db2'][3]))),
-                               int(dfa['d1'][4])-int(int(dfa['d2'][4])-int(dfa['db1'][4])-(int(dfa['db2'][4]))),
-                               int(dfa['d1'][5])-int(int(dfa['d2'][5])-int(dfa['db1'][5])-(int(dfa['db2'][5]))),
-                               int(dfa['d1'][6])-int(int(dfa['d2'][6])-int(dfa['db1'][6])-(int(dfa['db2'][6]))),
-                               int(int(dfa['d1'][7])-int(int(dfa['d2'][7])-int(dfa['db1'][7])-(int(dfa['db2'][7])))) + int(int(dfa['d1'][8])-(int(dfa['d2'][8])-int(dfa['db1'][8])-(int(dfa['db2'][8]))))],
-                            y=['12-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+'],
-                            orientation='h',
-                            marker_color='#F5C05F',
-                            name='Prima Dose'
-                            ),
-                     go.Bar(x=[int(dfa['d2'][0])-int(dfa['db1'][0])-(int(dfa['db2'][0])),
-                               int(dfa['d2'][1])-int(dfa['db1'][1])-(int(dfa['db2'][1])),
-                               int(dfa['d2'][2])-int(dfa['db1'][2])-(int(dfa['db2'][2])),
-                               int(dfa['d2'][3])-int(dfa['db1'][3])-(int(dfa['db2'][3])),
-                               int(dfa['d2'][4])-int(dfa['db1'][4])-(int(dfa['db2'][4])),
-                               int(dfa['d2'][5])-int(dfa['db1'][5])-(int(dfa['db2'][5])),
-                               int(dfa['d2'][6])-int(dfa['db1'][6])-(int(dfa['db2'][6])),
-                               int(int(dfa['d2'][7])-int(dfa['db1'][7])-(int(dfa['db2'][7])))+int(int(dfa['d2'][8])-int(dfa['db1'][8])-(int(dfa['db2'][8])))],
-                            y=['12-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+'],
-                            orientation='h',
-                            marker_color='#E83A8E',
-                            name='Seconda Dose'
-                            ),
-                     go.Bar(x=[int(dfa['db1'][0]) - (int(dfa['db2'][0])),
-                               int(dfa['db1'][1]) - (int(dfa['db2'][1])),
-                               int(dfa['db1'][2]) - (int(dfa['db2'][2])),
-                               int(dfa['db1'][3]) - (int(dfa['db2'][3])),
-                               int(dfa['db1'][4]) - (int(dfa['db2'][4])),
-                               int(dfa['db1'][5]) - (int(dfa['db2'][5])),
-                               int(dfa['db1'][6]) - (int(dfa['db2'][6])),
-                               int(int(dfa['db1'][7]) - (int(dfa['db2'][7]))) + int(int(dfa['db1'][8]) - (int(dfa['db2'][8])))],
-                            y=['12-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+'],
-                            orientation='h',
-                            marker_color='#B768FE',
-                            name='Terza Dose'
-                            ),
-
-                     go.Bar(x=[int(dfa['db2'][0]),
-                               int(dfa['db2'][1]),
-                               int(dfa['db2'][2]),
-                               int(dfa['db2'][3]),
-                               int(dfa['db2'][4]),
-                               int(dfa['db2'][5]),
-                               int(dfa['db2'][6]),
-                               int(int(dfa['db2'][7]))+int(int(dfa['db2'][8]))],
-                            y=['12-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+'],
-                            orientation='h',
-                            marker_color='#5B3EAB',
-                            name='Quarta Dose'
-                            ),
-                     go.Bar(x=[int(tot_dfe.loc[tot_dfe.index[0], 'totale_popolazione']) - int(dfa['d2'][0]),
-                               int(tot_dfe.loc[tot_dfe.index[1], 'totale_popolazione']) - int(dfa['d2'][1]),
-                               int(tot_dfe.loc[tot_dfe.index[2], 'totale_popolazione']) - int(dfa['d2'][2]),
-                               int(tot_dfe.loc[tot_dfe.index[3], 'totale_popolazione']) - int(dfa['d2'][3]),
-                               int(tot_dfe.loc[tot_dfe.index[4], 'totale_popolazione']) - int(dfa['d2'][4]),
-                               int(tot_dfe.loc[tot_dfe.index[5], 'totale_popolazione']) - int(dfa['d2'][5]),
-                               int(tot_dfe.loc[tot_dfe.index[6], 'totale_popolazione']) - int(dfa['d2'][6]),
-                               int(int(tot_dfe.loc[tot_dfe.index[7], 'totale_popolazione'])+int(tot_dfe.loc[tot_dfe.index[8], 'totale_popolazione'])) - int(int(dfa['d1'][7])+int(dfa['d1'][8]))],
-                            y=['12-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+'],
-                            orientation='h',
-                            marker_color='#6181E8',
-                            name='Non vaccinati'
-                            )
-                     ],
-            'layout': {
-                'barmode': 'stack',  # stack data
-                'height': 340,  # px
-                'xaxis': dict(rangeslider=dict(visible=False)),
-                'legend': dict(
-                    orientation="h",
-                    xanchor="center",
-                    x=0.5, y=-0.2
-                )
-            },
-        }
-    else:
-        if regione == 'Provincia Autonoma Bolzano / Bozen': reg = 'P.A. Bolzano'
-        elif regione == 'Provincia Autonoma Trento': reg = 'P.A. Trento'
-        elif regione == "Valle d'Aosta / Vallée d'Aoste": reg = "Valle d'Aosta"
-        else: reg = regione
-        ds1 = pandas.read_csv(somministrazioni)
-        dfe1 = pandas.read_csv(fascia_anagrafica)
-        reg_ds1 = ds1.loc[ds1['reg'] == regione]
-        dfa1 = reg_ds1.copy().groupby('eta').agg({'d1': 'sum', 'd2': 'sum', 'db1': 'sum'}).reset_index()
-        reg_dfe1 = dfe1.loc[dfe1['reg'] == reg]
-        figure_age = {
-            'data': [go.Bar(x=[int(dfa1['d1'][0])-int(int(dfa1['d2'][0])-int(dfa1['db1'][0])-(int(dfa1['db2'][0]))),
-                               int(dfa1['d1'][1])-int(int(dfa1['d2'][1])-int(dfa1['db1'][1])-(int(dfa1['db2'][1]))),
-                               int(dfa1['d1'][2])-int(int(dfa1['d2'][2])-int(dfa1['db1'][2])-(int(dfa1['db2'][2]))),
-                               int(dfa1['d1'][3])-int(int(dfa1['d2'][3])-int(dfa1['db1'][3])-(int(dfa1['db2'][3]))),
-                               int(dfa1['d1'][4])-int(int(dfa1['d2'][4])-int(dfa1['db1'][4])-(int(dfa1['db2'][4]))),
-                               int(dfa1['d1'][5])-int(int(dfa1['d2'][5])-int(dfa1['db1'][5])-(int(dfa1['db2'][5]))),
-                               int(dfa1['d1'][6])-int(int(dfa1['d2'][6])-int(dfa1['db1'][6])-(int(dfa1['db2'][6]))),
-                               int(int(dfa1['d1'][7])-int(int(dfa1['d2'][7])-int(dfa1['db1'][7])-(int(dfa1['db2'][7])))) + int(int(dfa1['d1'][8])-(int(dfa1['d2'][8])-int(dfa1['db1'][8])-(int(dfa1['db2'][8]))))],
-                            y=['12-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+'],
-                            orientation='h',
-                            marker_color='#F5C05F',
-                            name='Prima Dose'
-                            ),
-                     go.Bar(x=[int(dfa1['d2'][0])-int(dfa1['db1'][0])-(int(dfa1['db2'][0])),
-                               int(dfa1['d2'][1])-int(dfa1['db1'][1])-(int(dfa1['db2'][1])),
-                               int(dfa1['d2'][2])-int(dfa1['db1'][2])-(int(dfa1['db2'][2])),
-                               int(dfa1['d2'][3])-int(dfa1['db1'][3])-(int(dfa1['db2'][3])),
-                               int(dfa1['d2'][4])-int(dfa1['db1'][4])-(int(dfa1['db2'][4])),
-                               int(dfa1['d2'][5])-int(dfa1['db1'][5])-(int(dfa1['db2'][5])),
-                               int(dfa1['d2'][6])-int(dfa1['db1'][6])-(int(dfa1['db2'][6])),
-                               int(int(dfa1['d2'][7])-int(dfa1['db1'][7])-(int(dfa1['db2'][7])))+int(int(dfa1['d2'][8])-int(dfa1['db1'][8])-(int(dfa1['db2'][8])))],
-                            y=['12-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+'],
-                            orientation='h',
-                            marker_color='#E83A8E',
-                            name='Seconda Dose'
-                            ),
-                     go.Bar(x=[int(dfa1['db1'][0]) - (int(dfa1['db2'][0])),
-                               int(dfa1['db1'][1]) - (int(dfa1['db2'][1])),
-                               int(dfa1['db1'][2]) - (int(dfa1['db2'][2])),
-                               int(dfa1['db1'][3]) - (int(dfa1['db2'][3])),
-                               int(dfa1['db1'][4]) - (int(dfa1['db2'][4])),
-                               int(dfa1['db1'][5]) - (int(dfa1['db2'][5])),
-                               int(dfa1['db1'][6]) - (int(dfa1['db2'][6])),
-                               int(int(dfa1['db1'][7]) - (int(dfa1['db2'][7]))) + int(int(dfa1['db1'][8]) - (int(dfa1['db2'][8])))],
-                            y=['12-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+'],
-                            orientation='h',
-                            marker_color='#B768FE',
-                            name='Terza Dose'
-                            ),
-
-                     go.Bar(x=[int(dfa1['db2'][0]),
-                               int(dfa1['db2'][1]),
-                               int(dfa1['db2'][2]),
-                               int(dfa1['db2'][3]),
-                               int(dfa1['db2'][4]),
-                               int(dfa1['db2'][5]),
-                               int(dfa1['db2'][6]),
-                               int(int(dfa1['db2'][7]))+int(int(dfa1['db2'][8]))],
-                            y=['12-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+'],
-                            orientation='h',
-                            marker_color='#5B3EAB',
-                            name='Quarta Dose'
-                            ),
-                     go.Bar(x=[int(reg_dfe1.loc[reg_dfe1.index[0], 'totale_popolazione']) - int(dfa1['d2'][0]),
-                               int(reg_dfe1.loc[reg_dfe1.index[1], 'totale_popolazione']) - int(dfa1['d2'][1]),
-                               int(reg_dfe1.loc[reg_dfe1.index[2], 'totale_popolazione']) - int(dfa1['d2'][2]),
-                               int(reg_dfe1.loc[reg_dfe1.index[3], 'totale_popolazione']) - int(dfa1['d2'][3]),
-                               int(reg_dfe1.loc[reg_dfe1.index[4], 'totale_popolazione']) - int(dfa1['d2'][4]),
-                               int(reg_dfe1.loc[reg_dfe1.index[5], 'totale_popolazione']) - int(dfa1['d2'][5]),
-                               int(reg_dfe1.loc[reg_dfe1.index[6], 'totale_popolazione']) - int(dfa1['d2'][6]),
-                               int(int(reg_dfe1.loc[reg_dfe1.index[7], 'totale_popolazione'])+int(reg_dfe1.loc[reg_dfe1.index[8], 'totale_popolazione'])) - int(int(dfa1['d1'][7])+int(dfa1['d1'][8]))],
-                            y=['12-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+'],
-                            orientation='h',
-                            marker_color='#6181E8',
-                            name='Non vaccinati'
-                            )
-                     ],
-            'layout': {
-                'barmode': 'stack',  # stack data
-                'height': 340,  # px
-                'xaxis': dict(rangeslider=dict(visible=False)),
-                'legend': dict(
-                    orientation="h",
-                    xanchor="center",
-                    x=0.5, y=-0.2
-                )
-            },
-        }
+    s = snapshot
+    serie = age_bands(s, [regione])[0]
+    figure_age = {
+        'data': [go.Bar(x=serie[i],
+                        y=[label for label, gruppi in fasce_eta],
+                        orientation='h',
+                        marker_color=color,
+                        name=name
+                        ) for i, (name, color, coeff) in enumerate(serie_eta)],
+        'layout': {
+            'barmode': 'stack',  # stack data
+            'height': 340,  # px
+            'xaxis': dict(rangeslider=dict(visible=False)),
+            'legend': dict(
+                orientation="h",
+                xanchor="center",
+                x=0.5, y=-0.2
+            )
+        },
+    }
     return html.Div([
         dcc.Graph(
             figure=figure_age,
@@ -912,46 +1531,37 @@ def vaccine_age_bar(regione):
         )
     ], className='bar')
 
-# forecast
-def previsione():
-    global month_last_day_vaccine
-    date_format = "%Y-%m-%d"  # date format
-    ora = datetime.strptime(str(today), date_format)
-    l = len(ds_dosi['data'])  # total vaccine day
-    sett = 42252000  #70
-    settc = 45270000  #75
-    ott = 48288000  #80%
-    ottc= 51306000  #85%
-    nov = 54324000  #90%
-    # month
-    month_prima = ds_dosi.loc[ds_dosi['data'].between(str(ora - relativedelta(months=1))[:10], str(ora)[:10]), ['d1']].sum()
-    month_seconda = ds_dosi.loc[ds_dosi['data'].between(str(ora - relativedelta(months=1))[:10], str(ora)[:10]), ['d2']].sum()
-    month_terza = ds_dosi.loc[ds_dosi['data'].between(str(ora - relativedelta(months=1))[:10], str(ora)[:10]), ['db1']].sum()
-    month_quarta = int(ds_dosi.loc[ds_dosi['data'].between(str(ora - relativedelta(months=1))[:10], str(ora)[:10]), ['db2']].sum())
-    month_day_passati = (ora - (ora - relativedelta(months=1))).days
-    # first
-    month_day_p = ((60360000 - int(tot_prima)) / int(month_prima)) * month_day_passati
-    month_last_day_p = str(ora + timedelta(days=month_day_p))[:10]
-    month_day_90_p = ((ottc - int(tot_prima)) / int(month_prima)) * month_day_passati  # 85%
-    month_last_day_90_p = str(ora + timedelta(days=month_day_90_p))[:10]
-    # second
-    month_day_s = ((60360000 - int(tot_seconda)) / int(month_seconda)) * month_day_passati
-    month_last_day_s = str(ora + timedelta(days=month_day_s) + timedelta(days=month_day_p))[:10]
-    month_day_90_s = ((ott - int(tot_seconda)) / int(month_seconda)) * month_day_passati  # 80%
-    month_last_day_90_s = str(ora + timedelta(days=month_day_90_s) + timedelta(days=month_day_90_p))[:10]
-    # third
-    month_day_t = ((60360000 - int(tot_terza)) / int(month_terza)) * month_day_passati
-    month_last_day_t = str(ora + timedelta(days=month_day_t) + timedelta(days=month_day_s) + timedelta(days=month_day_p))[:10]
-    month_day_90_t = ((sett - int(tot_terza)) / int(month_terza)) * month_day_passati  # 70%
-    month_last_day_90_t = str(ora + timedelta(days=month_day_90_t) + timedelta(days=month_day_90_s) + timedelta(days=month_day_90_p))[:10]
-    # fourth
-    month_day_q = ((60360000 - int(tot_quarta)) / month_quarta) * month_day_passati
-    month_last_day_q = str(ora + timedelta(days=month_day_q) + timedelta(days=month_day_t) + timedelta(days=month_day_s) + timedelta(days=month_day_p))[:10]
-    month_day_90_q = ((sett - int(tot_quarta)) / int(month_quarta)) * month_day_passati  # 70%
-    month_last_day_90_q = str(ora + timedelta(days=month_day_90_q) + timedelta(days=month_day_90_t) + timedelta(days=month_day_90_s) + timedelta(days=month_day_90_p))[:10]
-
-    # last day 90% vaccine
-    month_last_day_vaccine = month_last_day_90_p
+# dropdown select
+def dropdown_previsione(s):
+    return html.Div([
+        html.Div([
+            dbc.Container([
+                dbc.Row([
+                    dbc.Col(
+                        dcc.Dropdown(id='dropdown_previsione',
+                                     options=get_dropdown_data(s), clearable=False, searchable=False,
+                                     persistence=True, persistence_type='session', value='Dato Nazionale'),
+                        style={'margin-left': 'auto', 'margin-right': 'auto'}, width=12, lg=5, className='mt-2'
+                    )
+                ])
+            ])
+        ])
+    ])
+
+
+# forecast, read from the arrays of the snapshot
+@app.callback(
+    Output('previsione', 'children'),
+    [Input('dropdown_previsione', 'value')])
+@cached_figure
+def previsione(regione):
+    s = snapshot
+    riga = s.aree[regione]
+    k = kpi(s, regione)
+    p = s.previsioni
+    # cumulative doses, the text is the percentage shown on hover
+    cumulate = pandas.DataFrame(p.cumulate[riga], columns=[col for nome, col, label, color, obiettivi in previsione_dosi]).assign(data=p.giorni)
+    popolazione = k.popolazione
 
     return html.Div(  # main div
         dbc.Container([
@@ -960,48 +1570,35 @@ def previsione():
                     dcc.Graph(
                         figure={
                             'data': [
-                                go.Bar(x=ds_dosi['data'],
-                                       y=((ds_dosi['db2'].cumsum()) / 60360000),
+                                go.Bar(**series_x(cumulate),
+                                       y=(cumulate['db2'] / popolazione).round(6),
                                        name='Incremento Quarte Dosi', marker=dict(color='#5B3EAB')),
-                                go.Bar(x=ds_dosi['data'],
-                                       y=(((ds_dosi['db1'].cumsum()) / 60360000) - ((ds_dosi['db2'].cumsum()) / 60360000)),
+                                go.Bar(**series_x(cumulate),
+                                       y=((cumulate['db1'] - cumulate['db2']) / popolazione).round(6),
                                        name='Incremento Terze Dosi', marker=dict(color='#B768FE')),
-                                go.Bar(x=ds_dosi['data'],
-                                       y=((ds_dosi['d2'].cumsum()) / 60360000) - ((ds_dosi['db1'].cumsum()) / 60360000),
-                                       text=(((ds_dosi['d2'].cumsum()) / 60360000) * 100).tolist(),
+                                go.Bar(**series_x(cumulate),
+                                       y=((cumulate['d2'] - cumulate['db1']) / popolazione).round(6),
+                                       text=numpy.floor(cumulate['d2'] / (popolazione / 100) + 0.5).astype(int).tolist(),
                                        name='Incremento Seconde Dosi', marker=dict(color='#78F5B3'),
                                        hovertemplate='%{text:.0f}' + '%'),
-                                go.Bar(x=ds_dosi['data'],
-                                       y=((ds_dosi['d1'].cumsum()) / 60360000) - ((ds_dosi['d2'].cumsum()) / 60360000),
-                                       text=(((ds_dosi['d1'].cumsum()) / 60360000) * 100).tolist(),
+                                go.Bar(**series_x(cumulate),
+                                       y=((cumulate['d1'] - cumulate['d2']) / popolazione).round(6),
+                                       text=numpy.floor(cumulate['d1'] / (popolazione / 100) + 0.5).astype(int).tolist(),
                                        name='Incremento Prime Dosi', marker=dict(color='#F5C05F'),
                                        hovertemplate='%{text:.0f}' + '%'),
-                                go.Scatter(x=[ds_dosi['data'][0], '2021-10-30'],
+                                go.Scatter(x=[date_label(p.giorni[0]), '2021-10-30'],
                                            y=[0, 1],
                                            mode='lines',
                                            name='Previsione del Governo Vaccinati',
                                            line=go.scatter.Line(color="#FA5541")),
-                                go.Scatter(x=[ds_dosi['data'][l - 1], month_last_day_90_p, month_last_day_p],
-                                           y=[int(tot_prima) / 60360000, 0.85, 1],
+                            ] + [
+                                go.Scatter(x=[date_label(p.giorni[-1]), *p.date[riga, f, d]],
+                                           y=[int(getattr(k, nome)) / popolazione, *obiettivi],
                                            type='scatter',
-                                           name='Previsione Mensile 1ª Dose',
-                                           line=go.scatter.Line(color="#F5C05F")),
-                                go.Scatter(x=[ds_dosi['data'][l - 1], month_last_day_90_s, month_last_day_s],
-                                           y=[int(tot_seconda) / 60360000, 0.8, 1],
-                                           type='scatter',
-                                           name='Previsione Mensile 2ª Dose',
-                                           line=go.scatter.Line(color="#78F5B3")),
-                                go.Scatter(x=[ds_dosi['data'][l - 1], month_last_day_90_t, month_last_day_t],
-                                           y=[int(tot_terza) / 60360000, 0.7, 1],
-                                           type='scatter',
-                                           name='Previsione Mensile 3ª Dose',
-                                           line=go.scatter.Line(color="#B768FE")),
-                                go.Scatter(
-                                    x=[ds_dosi['data'][l - 1], month_last_day_90_q, month_last_day_q],
-                                    y=[int(tot_quarta) / 60360000, 0.7, 1],
-                                    type='scatter',
-                                    name='Previsione Mensile 4ª Dose',
-                                    line=go.scatter.Line(color="#5B3EAB")),
+                                           name='Previsione ' + finestra + ' ' + label + ' Dose',
+                                           line=go.scatter.Line(color=color))
+                                for f, (finestra, lunghezza) in enumerate(previsione_finestre)
+                                for d, (nome, col, label, color, obiettivi) in enumerate(previsione_dosi)
                             ],
                             'layout': {
                                 'barmode': 'stack',
@@ -1029,23 +1626,33 @@ def previsione():
     )
 
 # dropdown
-def get_dropdown_data2():
+def get_dropdown_data2(s):
     selections = []
-    for reg in regions:
+    for reg in s.regions:
         selections.append(dict(label=reg, value=reg))
     return selections
 
-def dropdown_velocity_dosi_graph():
+def dropdown_velocity_dosi_graph(s):
     return html.Div([
         html.Div([
             dbc.Container([
                 dbc.Row([
                     dbc.Col(
                         dcc.Dropdown(id='dropdown_velocity_dosi_graph', multi=True,
-                                     options=get_dropdown_data2(), clearable=False, searchable=False,
+                                     options=get_dropdown_data2(s), clearable=False, searchable=False,
                                      persistence=True, persistence_type='session', value='Lombardia'),
                         style={'margin-left': 'auto', 'margin-right': 'auto'}, width=12, lg=5, className='mt-2'
                     )
+                ]),
+                dbc.Row([
+                    dbc.Col(
+                        dcc.Checklist(id='opzioni_velocity_dosi_graph',
+                                      options=[dict(label='Per 100.000 abitanti', value='abitanti'),
+                                               dict(label='Media 7 giorni', value='media')],
+                                      value=[], persistence=True, persistence_type='session',
+                                      inputStyle={'margin-left': '10px', 'margin-right': '5px'}),
+                        style={'text-align': 'center'}, width=12, className='mt-2'
+                    )
                 ])
             ])
         ])
@@ -1054,43 +1661,16 @@ def dropdown_velocity_dosi_graph():
 # effect contagi
 @app.callback(
     Output('velocity_dosi_graph', 'children'),
-    [Input('dropdown_velocity_dosi_graph', 'value')])
-def velocity_dosi_graph(regione):
-    ds1 = pandas.read_csv(somministrazioni)
-    data = ['']
-    traces = ['']
-    if type(regione) == str:
-        regione = [regione]
-    for reg in regione:
-        ds2 = ds1[ds1['reg'] == reg]
-        ds_dosi_velocity = ds2.groupby('data').agg({'d1': 'sum', 'd2': 'sum', 'db1': 'sum', 'db2': 'sum', 'reg': 'last'}).reset_index()
-        data.append(ds_dosi_velocity)
-    data.pop(0)
-    for dati in data:
-        traces.append(go.Scatter({'x': dati['data'], 'y': dati['d1']+dati['d2']+dati['db1']+dati['db2'], 'mode': 'lines',
-                                  'name': f"{dati['reg'].iloc[0]}"}))
-    traces.pop(0)
-
+    [Input('dropdown_velocity_dosi_graph', 'value'), Input('opzioni_velocity_dosi_graph', 'value')])
+@cached_figure
+def velocity_dosi_graph(regione, opzioni):
+    s = snapshot
     return html.Div([
         dbc.Container([
             dbc.Row(
                 dbc.Col(
                     dcc.Graph(
-                        figure={
-                            'data': traces,
-                            'layout': {
-                                'xaxis': dict(
-                                    rangeselector=dict(buttons=slider_button),
-                                    rangeslider=dict(visible=False),
-                                    type='date'
-                                ),
-                                'legend': dict(
-                                    orientation="h",
-                                    xanchor="center",
-                                    x=0.5, y=-0.2
-                                )
-                            }
-                        }, config=chart_config
+                        id='velocity_dosi_graph_figure', figure=velocity_dosi_figure(regione, opzioni, resolution(len(s.ds_dosi))), config=chart_config
                     )
                 )
             )
@@ -1098,15 +1678,53 @@ def velocity_dosi_graph(regione):
     ], className='container-1')
 
 
+# velocity zoom
+@app.callback(
+    Output('velocity_dosi_graph_figure', 'figure'),
+    [Input('velocity_dosi_graph_figure', 'relayoutData')],
+    [State('dropdown_velocity_dosi_graph', 'value'), State('opzioni_velocity_dosi_graph', 'value')],
+    prevent_initial_call=True)
+def velocity_dosi_graph_zoom(relayout, regione, opzioni):
+    s = snapshot
+    return velocity_dosi_figure(regione, opzioni, resolution(zoom_days(relayout) or len(s.ds_dosi)))
+
+
+@cached_figure
+def velocity_dosi_figure(regione, opzioni, freq):
+    s = snapshot
+    if type(regione) == str:
+        regione = [regione]
+    regione = [reg for reg in regione if reg in s.dosi_regioni]
+    confronto = confronto_regioni(s, regione, opzioni or [], freq)
+    traces = [go.Scatter({**series_x(confronto, freq), 'y': confronto[reg], 'mode': 'lines', 'name': reg}) for reg in regione]
+
+    return {
+        'data': traces,
+        'layout': {
+            'uirevision': True,
+            'xaxis': dict(
+                rangeselector=dict(buttons=slider_button),
+                rangeslider=dict(visible=False),
+                type='date'
+            ),
+            'legend': dict(
+                orientation="h",
+                xanchor="center",
+                x=0.5, y=-0.2
+            )
+        }
+    }
+
+
 # dropdown select
-def dropdown_effetti_decessi_contagi_graph():
+def dropdown_effetti_decessi_contagi_graph(s):
     return html.Div([
         html.Div([
             dbc.Container([
                 dbc.Row([
                     dbc.Col(
                         dcc.Dropdown(id='dropdown_effetti_decessi_contagi_graph',
-                                     options=get_dropdown_data(), clearable=False, searchable=False,
+                                     options=get_dropdown_data(s), clearable=False, searchable=False,
                                      persistence=True, persistence_type='session', value='Dato Nazionale'),
                         style={'margin-left': 'auto', 'margin-right': 'auto'}, width=12, lg=5, className='mt-2'
                     )
@@ -1116,59 +1734,26 @@ def dropdown_effetti_decessi_contagi_graph():
     ])
 
 
-# effect contagi
+# positives and deaths of the selected area in one round trip, both built from one slice of the DPC table
 @app.callback(
-    Output('effetti_contagi_graph', 'children'),
+    [Output('effetti_contagi_graph', 'children'), Output('effetti_decessi_graph', 'children')],
     [Input('dropdown_effetti_decessi_contagi_graph', 'value')])
-def effetti_contagi_graph(regione):
-    if regione == 'Dato Nazionale':
-        dec = ddc
-        dec['nuovi_positivi_avg'] = ddc['nuovi_positivi'].rolling(30).mean()
-    else:
-        # edit regions
-        if regione == 'Friuli-Venezia Giulia': regione = 'Friuli Venezia Giulia'
-        elif regione == 'Provincia Autonoma Bolzano / Bozen': regione = 'P.A. Bolzano'
-        elif regione == 'Provincia Autonoma Trento': regione = 'P.A. Trento'
-        elif regione == "Valle d'Aosta / Vallée d'Aoste": regione = "Valle d'Aosta"
-        ddcr = pandas.read_csv(decessi_contagi_regioni)
-        reg_ddcr = ddcr.loc[ddcr['denominazione_regione'] == regione]
-        dec = reg_ddcr.copy()
-        dec['nuovi_positivi_avg'] = dec['nuovi_positivi'].rolling(30).mean()
+@cached_figure
+def effetti_graphs(regione):
+    s = snapshot
+    dpc_area = cube_slice(s.dpc, regione)
+    freq = resolution(len(s.ddc))
+    return effetti_contagi_graph(effetti_contagi_chart(dpc_area, freq)), effetti_decessi_graph(effetti_decessi_chart(dpc_area, freq))
 
+
+# effect contagi
+def effetti_contagi_graph(figure):
     return html.Div([
         dbc.Container([
             dbc.Row(
                 dbc.Col(
                     dcc.Graph(
-                        figure={
-                            'data': [
-                                {'x': dec['data'], 'y': dec['nuovi_positivi'], 'type': 'bar', 'name': 'Nuovi Positivi',
-                                 'marker': dict(color='#D9615D')},
-                                # avg 30 day
-                                {'x': dec['data'], 'y': dec['nuovi_positivi_avg'], 'type': 'scatter',
-                                 'name': 'Media 30g',
-                                 'marker': dict(color='#FF726E')},
-                                # line start vaccine
-                                go.Scatter(x=['2020-12-27', '2020-12-27'],
-                                           y=[0, max(dec['nuovi_positivi'])],
-                                           mode='lines',
-                                           name='Inizio Vaccini',
-                                           hoverinfo='none',
-                                           line=go.scatter.Line(color="#4F4747"))
-                            ],
-                            'layout': {
-                                'xaxis': dict(
-                                    rangeselector=dict(buttons=slider_button),
-                                    rangeslider=dict(visible=False),
-                                    type='date'
-                                ),
-                                'legend': dict(
-                                    orientation="h",
-                                    xanchor="center",
-                                    x=0.5, y=-0.2
-                                )
-                            }
-                        }, config=chart_config
+                        id='effetti_contagi_graph_figure', figure=figure, config=chart_config
                     )
                 )
             )
@@ -1176,62 +1761,67 @@ def effetti_contagi_graph(regione):
     ], className='container-2')
 
 
-# effect contagi
+# contagi zoom
 @app.callback(
-    Output('effetti_decessi_graph', 'children'),
-    [Input('dropdown_effetti_decessi_contagi_graph', 'value')])
-def effetti_decessi_graph(regione):
-    if regione == 'Dato Nazionale':
-        ded = ddc
-        ded['nuovi_decessi'] = ded.deceduti.diff().fillna(ded.deceduti)
-        ded['nuovi_decessi'].iloc[121] = 31  # error -31
-        # avg
-        ded['nuovi_decessi_avg'] = ded['nuovi_decessi'].rolling(30).mean()
-    else:
-        # edit regions
-        if regione == 'Friuli-Venezia Giulia': regione = 'Friuli Venezia Giulia'
-        elif regione == 'Provincia Autonoma Bolzano / Bozen': regione = 'P.A. Bolzano'
-        elif regione == 'Provincia Autonoma Trento': regione = 'P.A. Trento'
-        elif regione == "Valle d'Aosta / Vallée d'Aoste": regione = "Valle d'Aosta"
-        ddcr = pandas.read_csv(decessi_contagi_regioni)
-        reg_ddcr = ddcr.loc[ddcr['denominazione_regione'] == regione]
-        ded = reg_ddcr.copy()
-        ded['nuovi_decessi'] = ded.deceduti.diff().fillna(ded.deceduti)
-        ded['nuovi_decessi_avg'] = ded['nuovi_decessi'].rolling(30).mean()
+    Output('effetti_contagi_graph_figure', 'figure'),
+    [Input('effetti_contagi_graph_figure', 'relayoutData')],
+    [State('dropdown_effetti_decessi_contagi_graph', 'value')],
+    prevent_initial_call=True)
+def effetti_contagi_graph_zoom(relayout, regione):
+    s = snapshot
+    return effetti_contagi_figure(regione, resolution(zoom_days(relayout) or len(s.ddc)))
+
 
+# figure of a zoom, cached by area and resolution
+@cached_figure
+def effetti_contagi_figure(regione, freq):
+    return effetti_contagi_chart(cube_slice(snapshot.dpc, regione), freq)
+
+
+# positives of an area
+def effetti_contagi_chart(dpc_area, freq):
+    dec = resample_frame(dpc_area, freq, ['nuovi_positivi', 'nuovi_positivi_avg'])
+
+    return {
+        'data': [
+            {**series_x(dec, freq), 'y': dec['nuovi_positivi'], 'type': 'bar', 'name': 'Nuovi Positivi',
+             'marker': dict(color='#D9615D')},
+            # avg 30 day
+            {**series_x(dec, freq), 'y': dec['nuovi_positivi_avg'], 'type': 'scatter',
+             'name': 'Media 30g',
+             'marker': dict(color='#FF726E')},
+            # line start vaccine
+            go.Scatter(x=['2020-12-27', '2020-12-27'],
+                       y=[0, max(dec['nuovi_positivi'])],
+                       mode='lines',
+                       name='Inizio Vaccini',
+                       hoverinfo='none',
+                       line=go.scatter.Line(color="#4F4747"))
+        ],
+        'layout': {
+            'uirevision': True,
+            'xaxis': dict(
+                rangeselector=dict(buttons=slider_button),
+                rangeslider=dict(visible=False),
+                type='date'
+            ),
+            'legend': dict(
+                orientation="h",
+                xanchor="center",
+                x=0.5, y=-0.2
+            )
+        }
+    }
+
+
+# effect decessi
+def effetti_decessi_graph(figure):
     return html.Div([
         dbc.Container([
             dbc.Row(
                 dbc.Col(
                     dcc.Graph(
-                        figure={
-                            'data': [
-                                {'x': ded['data'], 'y': ded['nuovi_decessi'], 'type': 'bar', 'name': 'Decessi',
-                                 'marker': dict(color='#756B6B')},
-                                # avg 30 day
-                                {'x': ded['data'], 'y': ded['nuovi_decessi_avg'], 'type': 'scatter', 'name': 'Media 30g',
-                                 'marker': dict(color='#C2B0B0')},
-                                # line start vaccine
-                                go.Scatter(x=['2020-12-27', '2020-12-27'],
-                                           y=[0, max(ded['nuovi_decessi'])],
-                                           mode='lines',
-                                           name='Inizio Vaccini',
-                                           hoverinfo='none',
-                                           line=go.scatter.Line(color="#1F1C1C"))
-                            ],
-                            'layout': {
-                                'xaxis': dict(
-                                    rangeselector=dict(buttons=slider_button),
-                                    rangeslider=dict(visible=False),
-                                    type='date'
-                                ),
-                                'legend': dict(
-                                    orientation="h",
-                                    xanchor="center",
-                                    x=0.5, y=-0.2
-                                )
-                            }
-                        }, config=chart_config
+                        id='effetti_decessi_graph_figure', figure=figure, config=chart_config
                     )
                 )
             )
@@ -1239,6 +1829,58 @@ def effetti_decessi_graph(regione):
     ], className='container-2')
 
 
+# decessi zoom
+@app.callback(
+    Output('effetti_decessi_graph_figure', 'figure'),
+    [Input('effetti_decessi_graph_figure', 'relayoutData')],
+    [State('dropdown_effetti_decessi_contagi_graph', 'value')],
+    prevent_initial_call=True)
+def effetti_decessi_graph_zoom(relayout, regione):
+    s = snapshot
+    return effetti_decessi_figure(regione, resolution(zoom_days(relayout) or len(s.ddc)))
+
+
+# figure of a zoom, cached by area and resolution
+@cached_figure
+def effetti_decessi_figure(regione, freq):
+    return effetti_decessi_chart(cube_slice(snapshot.dpc, regione), freq)
+
+
+# deaths of an area
+def effetti_decessi_chart(dpc_area, freq):
+    ded = resample_frame(dpc_area, freq, ['nuovi_decessi', 'nuovi_decessi_avg'])
+
+    return {
+        'data': [
+            {**series_x(ded, freq), 'y': ded['nuovi_decessi'], 'type': 'bar', 'name': 'Decessi',
+             'marker': dict(color='#756B6B')},
+            # avg 30 day
+            {**series_x(ded, freq), 'y': ded['nuovi_decessi_avg'], 'type': 'scatter', 'name': 'Media 30g',
+             'marker': dict(color='#C2B0B0')},
+            # line start vaccine
+            go.Scatter(x=['2020-12-27', '2020-12-27'],
+                       y=[0, max(ded['nuovi_decessi'])],
+                       mode='lines',
+                       name='Inizio Vaccini',
+                       hoverinfo='none',
+                       line=go.scatter.Line(color="#1F1C1C"))
+        ],
+        'layout': {
+            'uirevision': True,
+            'xaxis': dict(
+                rangeselector=dict(buttons=slider_button),
+                rangeslider=dict(visible=False),
+                type='date'
+            ),
+            'legend': dict(
+                orientation="h",
+                xanchor="center",
+                x=0.5, y=-0.2
+            )
+        }
+    }
+
+
 # dropdown select
 def dropdown_riduzione_graph():
     return html.Div([
@@ -1266,84 +1908,16 @@ def dropdown_riduzione_graph():
 @app.callback(
     Output('riduzione_graph', 'children'),
     [Input('dropdown_riduzione_graph', 'value')])
+@cached_figure
 def riduzione_graph(value):
-    ds1 = pandas.read_csv(somministrazioni)
-    ddcr = pandas.read_csv(decessi_contagi_regioni)
-    date_format = "%Y-%m-%d"  # date format
-    ora = datetime.strptime(str(today), date_format)
-    traces = ['']
-
-    for reg in regions:
-        # contagi
-        if reg == 'Friuli-Venezia Giulia': reg1 = 'Friuli Venezia Giulia'
-        elif reg == 'Provincia Autonoma Bolzano / Bozen': reg1 = 'P.A. Bolzano'
-        elif reg == 'Provincia Autonoma Trento': reg1 = 'P.A. Trento'
-        elif reg == "Valle d'Aosta / Vallée d'Aoste": reg1 = "Valle d'Aosta"
-        else: reg1 = reg
-        # population
-        if reg1 == 'Abruzzo': popolazione = 1312000
-        elif reg1 == 'Basilicata': popolazione = 562869
-        elif reg1 == 'Calabria': popolazione = 1947000
-        elif reg1 == 'Campania': popolazione = 5802000
-        elif reg1 == 'Emilia-Romagna': popolazione = 4459000
-        elif reg1 == 'Friuli Venezia Giulia': popolazione = 1215000
-        elif reg1 == 'Lazio': popolazione = 5879000
-        elif reg1 == 'Liguria': popolazione = 1551000
-        elif reg1 == 'Lombardia': popolazione = 10060000
-        elif reg1 == 'Marche': popolazione = 1525000
-        elif reg1 == 'Molise': popolazione = 305617
-        elif reg1 == 'P.A. Bolzano': popolazione = 520891
-        elif reg1 == 'P.A. Trento': popolazione = 538223
-        elif reg1 == 'Piemonte': popolazione = 4356000
-        elif reg1 == 'Puglia': popolazione = 4029000
-        elif reg1 == 'Sardegna': popolazione = 1640000
-        elif reg1 == 'Sicilia': popolazione = 5000000
-        elif reg1 == 'Toscana': popolazione = 3730000
-        elif reg1 == 'Umbria': popolazione = 882015
-        elif reg1 == "Valle d'Aosta": popolazione = 125666
-        elif reg1 == 'Veneto': popolazione = 4906000
-        # data contagi
-        ddcr2 = ddcr.loc[ddcr['denominazione_regione'] == reg1]
-        ded = ddcr2
-        ded['nuovi_decessi'] = ded.deceduti.diff().fillna(ded.deceduti)
-        ded['nuovi_decessi'].iloc[121] = 31  # error -31
-        ospd = ddcr2
-        ospd['nuovi_ospedalizzati'] = ospd.totale_ospedalizzati.diff().fillna(ospd.totale_ospedalizzati)
-        # contagi
-        ddcr_contagi = ddcr2.loc[ddcr2['data'].between(str(ora - timedelta(days=7))[:10], str(ora)[:10]), ['nuovi_positivi']].sum()
-        positive = round((int(ddcr_contagi) * 100000) / popolazione, 2)
-        # ospedalizzati
-        ddcr_osp = ospd.loc[ddcr2['data'].between(str(ora - timedelta(days=7))[:10], str(ora)[:10]), ['nuovi_ospedalizzati']].sum()
-        osp = round((int(ddcr_osp) * 100000) / popolazione, 2)
-        # TI
-        ddcr_ti = ddcr2.loc[ddcr2['data'].between(str(ora - timedelta(days=7))[:10], str(ora)[:10]), ['ingressi_terapia_intensiva']].sum()
-        ti = round((int(ddcr_ti) * 100000) / popolazione, 2)
-        # Deceduti
-        ddcr_deceduti = ded.loc[ded['data'].between(str(ora - timedelta(days=7))[:10], str(ora)[:10]), ['nuovi_decessi']].sum()
-        deceduti = round((int(ddcr_deceduti) * 100000) / popolazione, 2)
-        # doses
-        ds2 = ds1[ds1['reg'] == reg]
-        ds_dosi_velocity = ds2.groupby('data').agg({'d2': 'sum', 'reg': 'last'}).reset_index()
-        doses = ds_dosi_velocity.loc[ds_dosi_velocity['data'].between('2020-12-27', str(today)), ['d2']].sum()
-        doses_percent = round((int(doses) / popolazione) * 100, 2)
-        # traces
-        if value == 'Nuovi Positivi':
-            if float(positive) < 0:
-                positive = 0
-            traces.append(go.Scatter({'x': [float(positive)], 'y': [float(doses_percent)], 'mode': 'markers+text', 'marker': dict(color='crimson', size=12), 'text': f"{reg1}", 'textfont': dict(color='#B01B3E'), 'textposition': 'middle right', 'name': f"{reg1}"}))
-        elif value == 'Ospedalizzati':
-            if float(osp) < 0:
-                osp = 0
-            traces.append(go.Scatter({'x': [float(osp)], 'y': [float(doses_percent)], 'mode': 'markers+text', 'marker': dict(color='#088BBD', size=12), 'text': f"{reg1}", 'textfont': dict(color='#088BBD'), 'textposition': 'middle right', 'name': f"{reg1}"}))
-        elif value == 'Terapia Intensiva':
-            if float(ti) < 0:
-                ti = 0
-            traces.append(go.Scatter({'x': [float(ti)], 'y': [float(doses_percent)], 'mode': 'markers+text', 'marker': dict(color='#C9BF30', size=12), 'text': f"{reg1}", 'textfont': dict(color='#C9BF30'), 'textposition': 'middle right', 'name': f"{reg1}"}))
-        else:
-            if float(deceduti) < 0:
-                deceduti = 0
-            traces.append(go.Scatter({'x': [float(deceduti)], 'y': [float(doses_percent)], 'mode': 'markers+text', 'marker': dict(color='#756B6B', size=12), 'text': f"{reg1}", 'textfont': dict(color='#756B6B'), 'textposition': 'middle right', 'name': f"{reg1}"}))
-    traces.pop(0)
+    s = snapshot
+    # marker and text color of each metric
+    colori = {'Nuovi Positivi': ('crimson', '#B01B3E'), 'Ospedalizzati': ('#088BBD', '#088BBD'),
+              'Terapia Intensiva': ('#C9BF30', '#C9BF30'), 'Decessi': ('#756B6B', '#756B6B')}
+    metrica = value if value in colori else 'Decessi'
+    traces = [go.Scatter({'x': s.riduzione[metrica].tolist(), 'y': s.riduzione['vaccinati'].tolist(), 'mode': 'markers+text',
+                          'marker': dict(color=colori[metrica][0], size=12), 'text': s.riduzione.index.tolist(),
+                          'textfont': dict(color=colori[metrica][1]), 'textposition': 'middle right'})]
 
     return html.Div([
         dbc.Container([
@@ -1366,25 +1940,26 @@ def riduzione_graph(value):
     ], className='container-1')
 
 def layout():
-    refresh_data()
+    s = snapshot  # one snapshot for the whole page
+    italia = kpi(s, 'Dato Nazionale')
     return html.Div([
         # style
         html.Link(rel="stylesheet", media="screen and (min-width: 900px)", href="./assets/big.css"),
         html.Link(rel="stylesheet", media="screen and (max-width: 900px)", href="./assets/small.css"),
         # vaccine total
         html.Div([html.Br(), html.Br(), html.Center(html.H1('Vaccini')), html.Br(), html.Br()]),
-        html.Div([vaccine_update()]),
-        html.Div([vaccine_update_mono()]),
-        html.Div([vaccine_update_bar()]),  # orizzonatl bar
+        html.Div([vaccine_update(italia)]),
+        html.Div([vaccine_update_mono(italia)]),
+        html.Div([vaccine_update_bar(italia)]),  # orizzonatl bar
         # text
         html.Div(html.Center(html.I([html.Br(), "L'obiettivo della campagna di vaccinazione della popolazione è prevenire le morti da COVID-19 e raggiungere al più presto ",
                                      html.B("l'immunità di gregge"), " per il SARS-CoV2", html.Br(), "La campagna è partita il ", html.B("27 dicembre 2020"), ", ad oggi il ",
-                                     html.B(str(secondadose)+" %"), " della popolazione ha completato il ciclo vaccinale", html.Br(), "La ", html.B("quarta dose"),
+                                     html.B(str(italia.vaccinati_pop)+" %"), " della popolazione ha completato il ciclo vaccinale", html.Br(), "La ", html.B("quarta dose"),
                                      " verrà somministrata inizialmente a trapiantati e immunodepressi", html.Br(), html.Br(), html.Br()], style={'font-size': 'large'}))),
-        html.Div([vaccine_healed()]),
+        html.Div([vaccine_healed(italia)]),
         # daily data
-        html.Div([html.Br(), html.Br(), html.Br(), html.Br(), html.Center(html.H1('Dati del Giorno')), html.Center(html.I('dati aggionati del '+str(last_update), style={'font-size': '14px'})), html.Br()]),
-        html.Div([dropdown_vaccine_daily(), html.Br()]),  # dropdown
+        html.Div([html.Br(), html.Br(), html.Br(), html.Br(), html.Center(html.H1('Dati del Giorno')), html.Center(html.I('dati aggionati del '+str(s.last_update), style={'font-size': '14px'})), html.Br()]),
+        html.Div([dropdown_vaccine_daily(s), html.Br()]),  # dropdown
         html.Div(id='vaccine_daily'),
         # vaccine and doses
         html.Div([html.Br(), html.Br(), html.Center(html.H2('Vaccini & Dosi'))]),
@@ -1392,34 +1967,39 @@ def layout():
         # image
         html.Div(html.Center([html.Div([html.Img(src='./assets/ddoses.png', width="45", style={'vertical-align': 'bottom'}), html.B(' 2'), ' Dosi: ', html.I('Pfizer, Moderna e AstraZeneca', style={'font-size': '14px'})], className='container-2'), html.Div([html.Img(src='./assets/doses.png', width="30", style={'vertical-align': 'bottom'}), html.B(' 1'), ' Dose:', html.I(' Janssen', style={'font-size': '14px'})], className='container-2'),
                               html.Div([html.Br(), html.Br(), html.Br(), html.H2('Vaccini per fascia di età'), html.I('I dati sono calcolati sulle somministrazioni delle prime dosi', style={'font-size': '14px'})], className='container-1')], className='container-1')),
-        html.Div([dropdown_vaccine_age_bar()]),
+        html.Div([dropdown_vaccine_age_bar(s)]),
         html.Div(id='vaccine_age_bar'),
         html.Div([html.Div(id='category_global')], className='container-1'),
         # forecast
         html.Div([html.Br(), html.Br(), html.Br(), html.Center(html.H1('Previsioni')), html.Center(html.I('Il modello utilizza i dati giornalieri sulle somministrazioni delle prime dosi', style={'font-size': '14px'}))]),
-        html.Div([previsione()]),
+        html.Div([dropdown_previsione(s), html.Br()]),
+        html.Div(id='previsione'),
         # text forecast
-        html.Div(html.Center([html.Br(), "Nell'ultimo ", html.B("mese"), " sono state somministrate ", html.Mark([html.B(str(max_prima_f)), " prime dosi"], style={'background-color': '#F5C05F'}),
-             " in ", html.B("Italia"), " di cui ", html.Mark([html.B(str(tot_janssenf)), " monodose"], style={'background-color': '#F5C05F'}), html.Br(),
-             "A questo ritmo l' ", html.B("80% della popolazione"), " sarà vaccinata entro il ", html.Mark([str(month_last_day_vaccine)], style={'background-color': '#F5C05F'})])),
+        html.Div(html.Center([html.Br(), "Nell'ultimo ", html.B("mese"), " sono state somministrate ", html.Mark([html.B(str(s.max_prima_f)), " prime dosi"], style={'background-color': '#F5C05F'}),
+             " in ", html.B("Italia"), " di cui ", html.Mark([html.B('{:,}'.format(int(italia.janssen)).replace(',', '.')), " monodose"], style={'background-color': '#F5C05F'}), html.Br(),
+             "A questo ritmo l' ", html.B("80% della popolazione"), " sarà vaccinata entro il ", html.Mark([str(s.previsioni.date[0, 0, 0, 0])], style={'background-color': '#F5C05F'})])),
         # velocity
         html.Div([html.Br(), html.Br(), html.Br(), html.Center(html.H2('Velocità vaccinazioni')), html.Center(html.I('I dati sono calcolati con tutte le dosi', style={'font-size': '14px'}))]),
-        html.Div([dropdown_velocity_dosi_graph()]),
+        html.Div([dropdown_velocity_dosi_graph(s)]),
         html.Div([html.Div(id='velocity_dosi_graph')], className='container-1'),
         # effect
         html.Div([html.Br(), html.Br(), html.Br(), html.Center(html.H2('Effetti dei Vaccini nel Tempo')), html.Br()]),
-        html.Div([dropdown_effetti_decessi_contagi_graph(), html.Br()]),
+        html.Div([dropdown_effetti_decessi_contagi_graph(s), html.Br()]),
         html.Div([html.Div(id='effetti_contagi_graph'), html.Div(id='effetti_decessi_graph')], className='container-1'),
         # text effect
-        html.Div(html.Center([html.Div([html.Br(), "Contagi ", html.B("ultimo mese"), " in Italia: ", html.Mark([html.B("%s" %("+" if int(percent_mese) > 100 else "-")+str(float(percent_mese))+'%')], style={'background-color': '#F5C05F'})], className='container-2'),
-                              html.Div([html.Br(), "Decessi ", html.B("ultimo mese"), " in Italia: ", html.Mark([html.B("%s" %("+" if int(percent_mese_death) > 100 else "-")+str(float(percent_mese_death))+'%')], style={'background-color': '#F5C05F'})], className='container-2'),
+        html.Div(html.Center([html.Div([html.Br(), "Contagi ", html.B("ultimo mese"), " in Italia: ", html.Mark([html.B("%s" %("+" if int(italia.positivi_mese) > 100 else "-")+str(float(italia.positivi_mese))+'%')], style={'background-color': '#F5C05F'})], className='container-2'),
+                              html.Div([html.Br(), "Decessi ", html.B("ultimo mese"), " in Italia: ", html.Mark([html.B("%s" %("+" if int(italia.decessi_mese) > 100 else "-")+str(float(italia.decessi_mese))+'%')], style={'background-color': '#F5C05F'})], className='container-2'),
                               html.Div([html.Br(), html.Br(), html.Br(), html.H4('Quanto le vaccinazioni stanno contribuendo veramente alla riduzione dei contagi?'), html.I("I dati sono calcolati sulla percentuale di popolazione vaccinata e sull'incidenza dei contagi, (nell'ultima settimana) per 100.000 abitanti", style={'font-size': '14px'}), html.Br(), html.Br()], className='container-1')], className='container-1')),
         # text riduzione
         html.Div([dropdown_riduzione_graph()]),
         html.Div([html.Div(id='riduzione_graph')], className='container-1'),
     ])
 
-app.layout = layout
+if refresh_mode != 'publisher':  # the publisher has no derived data to lay out
+    app.layout = layout
 
 if __name__ == '__main__':
-    app.run_server(host='0.0.0.0', port=8050, debug=False)
+    if refresh_mode == 'publisher':
+        refresh_loop()
+    else:
+        app.run_server(host='0.0.0.0', port=8050, debug=False)
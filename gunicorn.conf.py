@@ -0,0 +1,60 @@
+# gunicorn -c gunicorn.conf.py app:server
+# one refresher process downloads the data and publishes the snapshot with its derived tables,
+# the workers only memory map the tables, so they share the pages; each worker maps a new snapshot within SNAPSHOT_POLL seconds
+import os
+import subprocess
+import sys
+import threading
+import time
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = '0.0.0.0:8050'
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+raw_env = ['REFRESH_MODE=reader']
+refresher_check = int(os.environ.get('REFRESHER_CHECK', 10))  # seconds between checks that the refresher is alive
+publish_wait = int(os.environ.get('PUBLISH_WAIT', 900))  # seconds the master waits for the first snapshot
+
+
+def start_refresher(server):
+    env = dict(os.environ, REFRESH_MODE='publisher')
+    server.refresher = subprocess.Popen([sys.executable, 'app.py'], cwd=chdir, env=env)
+
+
+def on_starting(server):
+    server.stopping = threading.Event()
+    start_refresher(server)
+    # the workers start from the first snapshot, wait for it
+    snapshot_dir = os.environ.get('SNAPSHOT_DIR', os.path.join(os.environ.get('CACHE_DIR', 'cache'), 'snapshot'))
+    current = os.path.join(chdir, snapshot_dir, 'current.json')
+    deadline = time.time() + publish_wait
+    server.log.info('waiting up to %d seconds for the first snapshot in %s', publish_wait, os.path.dirname(current))
+    while not os.path.exists(current) and server.refresher.poll() is None:
+        if time.time() > deadline:
+            # a refresher that keeps failing stays alive and retries, do not block the boot forever
+            server.refresher.terminate()
+            raise RuntimeError('no snapshot published in %s after %d seconds, check the refresher log for the failing source'
+                               % (os.path.dirname(current), publish_wait))
+        time.sleep(1)
+    if not os.path.exists(current):
+        raise RuntimeError('the refresher exited with code %s before publishing a snapshot' % server.refresher.returncode)
+
+
+# restart the refresher when it dies, meanwhile the workers keep serving the last snapshot;
+# the arbiter reaps every child, so the exit code is lost here
+def watch_refresher(server):
+    while not server.stopping.wait(refresher_check):
+        if server.refresher.poll() is not None:
+            server.log.error('refresher process %d exited, restarting it', server.refresher.pid)
+            start_refresher(server)
+
+
+def when_ready(server):
+    server.watcher = threading.Thread(target=watch_refresher, args=(server,), name='refresher_watch', daemon=True)
+    server.watcher.start()
+
+
+def on_exit(server):
+    server.stopping.set()
+    if getattr(server, 'watcher', None) is not None:
+        server.watcher.join()
+    server.refresher.terminate()